@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'psycopg2',
     'tgbot.apps.TgbotConfig',
 ]
@@ -106,6 +107,63 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 TELEGRAM_TOKEN = env('TELEGRAM_TOKEN')
 TELEGRAM_URL = 'https://api.telegram.org/bot'
 TELEGRAM_WEBHOOK_URL = env('TELEGRAM_WEBHOOK_URL')
+# Потоки для обработки обновлений (0 - обработка внутри запроса вебхука)
+TELEGRAM_WORKERS = env.int('TELEGRAM_WORKERS', default=4)
+TELEGRAM_QUEUE_SIZE = env.int('TELEGRAM_QUEUE_SIZE', default=1000)
+# Время на обработку принятых обновлений при остановке процесса (сек.)
+TELEGRAM_SHUTDOWN_TIMEOUT = env.float('TELEGRAM_SHUTDOWN_TIMEOUT', default=10)
+# Окно отбрасывания повторно доставленных обновлений (сек.), количество
+# update_id в памяти и общий кэш из CACHES (None - только память процесса)
+TELEGRAM_DEDUPE_WINDOW = env.int('TELEGRAM_DEDUPE_WINDOW', default=3600)
+TELEGRAM_DEDUPE_SIZE = env.int('TELEGRAM_DEDUPE_SIZE', default=100000)
+TELEGRAM_DEDUPE_CACHE = env('TELEGRAM_DEDUPE_CACHE', default=None)
+# Ожидание ответа на callback для возврата в теле ответа на вебхук (сек.,
+# 0 - не ждать). Поток веб-сервера занят на время ожидания
+TELEGRAM_WEBHOOK_REPLY_TIMEOUT = env.float(
+    'TELEGRAM_WEBHOOK_REPLY_TIMEOUT', default=0
+)
+# Ограничение исходящих запросов: в секунду на бота, на чат, запас на чат
+TELEGRAM_RATE_LIMIT = env.float('TELEGRAM_RATE_LIMIT', default=30)
+TELEGRAM_CHAT_RATE_LIMIT = env.float('TELEGRAM_CHAT_RATE_LIMIT', default=1)
+TELEGRAM_CHAT_BURST = env.int('TELEGRAM_CHAT_BURST', default=3)
+TELEGRAM_MAX_RETRIES = env.int('TELEGRAM_MAX_RETRIES', default=3)
+# Пул keep-alive соединений с Telegram API и таймауты запросов (секунды).
+# Размер пула - не меньше TELEGRAM_WORKERS и количества потоков веб-сервера
+TELEGRAM_POOL_SIZE = env.int(
+    'TELEGRAM_POOL_SIZE', default=max(TELEGRAM_WORKERS, 10)
+)
+TELEGRAM_CONNECT_TIMEOUT = env.float('TELEGRAM_CONNECT_TIMEOUT', default=3.05)
+TELEGRAM_READ_TIMEOUT = env.float('TELEGRAM_READ_TIMEOUT', default=10)
+# HTTP/2 для запросов к Telegram API (требует пакета httpx[http2])
+TELEGRAM_HTTP2 = env.bool('TELEGRAM_HTTP2', default=False)
+# Хранилище шагов диалога: database - таблица БД, cache - кэш Django
+# TELEGRAM_STEP_CACHE (например, Redis). Время действия шага (сек.)
+# в обоих хранилищах
+TELEGRAM_STEP_STORAGE = env('TELEGRAM_STEP_STORAGE', default='database')
+TELEGRAM_STEP_CACHE = env('TELEGRAM_STEP_CACHE', default='default')
+TELEGRAM_STEP_TTL = env.int('TELEGRAM_STEP_TTL', default=86400)
+
+# memory - индекс триграмм в памяти процесса, postgres - поиск через pg_trgm
+CITY_SEARCH_BACKEND = env('CITY_SEARCH_BACKEND', default='memory')
+CITY_TRIGRAM_SIMILARITY = env.float('CITY_TRIGRAM_SIMILARITY', default=0.3)
+# Количество городов на одной странице клавиатуры и всего в выдаче
+CITY_SUGGESTIONS = env.int('CITY_SUGGESTIONS', default=6)
+CITY_SEARCH_LIMIT = env.int('CITY_SEARCH_LIMIT', default=30)
+# Кэш результатов поиска городов: количество запросов и время жизни (сек.)
+CITY_CACHE_SIZE = env.int('CITY_CACHE_SIZE', default=1000)
+CITY_CACHE_TTL = env.int('CITY_CACHE_TTL', default=3600)
+# Версия справочника городов для сброса кэшей во всех процессах: кэш из
+# CACHES (при нескольких процессах - общий, например Redis) и период ее
+# сверки (сек.)
+CITY_VERSION_CACHE = env('CITY_VERSION_CACHE', default='default')
+CITY_VERSION_INTERVAL = env.float('CITY_VERSION_INTERVAL', default=10)
+# Ранжирование городов для пролистывания списка: кэш из CACHES (при
+# нескольких процессах - общий) и время хранения (сек.)
+CITY_RANKING_CACHE = env('CITY_RANKING_CACHE', default='default')
+CITY_RANKING_TTL = env.int('CITY_RANKING_TTL', default=3600)
+
+# Количество анкет, добавляемых в очередь поиска за одно заполнение
+SEARCH_PAGE_SIZE = env.int('SEARCH_PAGE_SIZE', default=20)
 
 LOGGING = {
     'version': 1,
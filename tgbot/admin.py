@@ -1,8 +1,11 @@
 from django.contrib import admin
 
-from .models import City, Profile, ProfileSearch, User
+from .models import (City, ConversationStep, Profile, ProfileSearch,
+                     StaticMedia, User)
 
 admin.site.register(User)
 admin.site.register(Profile)
 admin.site.register(ProfileSearch)
 admin.site.register(City)
+admin.site.register(StaticMedia)
+admin.site.register(ConversationStep)
@@ -0,0 +1,103 @@
+"""cache.py - Ограниченный LRU-кэш с временем жизни записей
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш
+
+    При переполнении вытесняется запись, к которой дольше всего
+    не обращались. Записи старше ttl секунд считаются отсутствующими.
+
+    :param int maxsize: Максимальное количество записей
+    :param ttl: Время жизни записи в секундах (None - без ограничения)
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Получение значения из кэша
+
+        :param key: Ключ записи
+        :return: Значение или None при отсутствии записи
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """Сохранение значения в кэш
+
+        :param key: Ключ записи
+        :param value: Значение (не None)
+        """
+        with self._lock:
+            self._store(key, value)
+
+    def add(self, key, value):
+        """Сохранение значения, только если записи нет (атомарно)
+
+        :param key: Ключ записи
+        :param value: Значение (не None)
+        :return: False, если действующая запись уже есть
+        :rtype: bool
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires = item[1]
+                if expires is None or expires > time.monotonic():
+                    self.hits += 1
+                    return False
+            self.misses += 1
+            self._store(key, value)
+            return True
+
+    def delete(self, key):
+        """Удаление записи
+
+        :param key: Ключ записи
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _store(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """Удаление всех записей"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Счетчики использования кэша
+
+        :return: Количество попаданий, промахов и записей
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+            }
@@ -0,0 +1,445 @@
+"""cities.py - Поиск населенных пунктов по наименованию от пользователя
+
+Способ поиска задается настройкой CITY_SEARCH_BACKEND:
+- memory - инвертированный индекс триграмм, который строится один раз
+  на процесс. Индекс отбирает небольшой набор кандидатов, и только для них
+  считается SequenceMatcher.ratio();
+- postgres - поиск выполняется в БД через pg_trgm (GIN-индекс по
+  tgbot_city.name_normalized), таблица городов в память не загружается.
+
+Нечеткий поиск сравнивает нормализованный запрос с нормализованными
+наименованиями, поэтому результат зависит только от ключа кэша.
+
+Оба способа возвращают не более CITY_SEARCH_LIMIT лучших совпадений
+в порядке убывания сходства. Ранжирование сохраняется в общем кэше
+CITY_RANKING_CACHE, чтобы листать длинные списки без повторного поиска
+в любом процессе бота.
+
+Перед нечетким поиском выполняется поиск по индексу нормализованного
+наименования (точное совпадение, затем совпадение по началу строки).
+
+Результаты поиска кэшируются по нормализованному запросу. Сами города
+хранятся в реестре city_registry, поэтому вывод городов пользователю
+не требует запросов к БД. Кэш и реестр сбрасываются при изменении
+таблицы городов: изменивший ее процесс меняет версию справочника
+в общем кэше CITY_VERSION_CACHE, остальные процессы сверяют версию
+не реже раза в CITY_VERSION_INTERVAL секунд.
+"""
+import heapq
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.core.cache import caches
+from django.db.models import Q
+from django.db.models.functions import Length
+
+from .cache import LRUCache
+from .models import City
+from .utils import normalize_city_name
+
+SIMILARITY_RATIO = 0.8
+UNSET_CITY_NAME = 'Город не установлен'
+CITY_VERSION_KEY = 'tgbot:cities:version'
+CITY_RANKING_KEY = 'tgbot:cities:ranking:{token}'
+
+
+def get_trigrams(text):
+    """Разбиение строки на триграммы
+
+    Строка дополняется двумя пробелами в начале и одним в конце,
+    поэтому у строки длины n ровно n + 1 триграмма.
+
+    :param str text: Исходная строка
+    :return: Количество вхождений каждой триграммы
+    :rtype: Counter
+    """
+    padded = f'  {text} '
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class CityIndex:
+    """Инвертированный индекс триграмм по наименованиям городов
+
+    Если SequenceMatcher.ratio() > 0.8, то совпадающие блоки строк
+    разрушают меньше len(name) триграмм запроса, т.е. у запроса и города
+    остается не менее двух общих триграмм (с учетом кратности).
+    Поэтому отбор кандидатов не теряет ни одного совпадения.
+    """
+
+    def __init__(self, cities):
+        self.cities = list(cities)
+        self.trigrams = defaultdict(list)
+        for position, city in enumerate(self.cities):
+            for trigram, count in get_trigrams(city.name_normalized).items():
+                self.trigrams[trigram].append((position, count))
+
+    def candidates(self, name):
+        """Отбор городов, у которых достаточно общих триграмм с запросом
+
+        :param str name: Нормализованное наименование города
+        :return: Позиции городов-кандидатов в порядке возрастания
+        :rtype: list
+        """
+        query = get_trigrams(name)
+        threshold = min(2, len(name) + 1)
+        shared = defaultdict(int)
+        for trigram, count in query.items():
+            for position, city_count in self.trigrams.get(trigram, ()):
+                shared[position] += min(count, city_count)
+        return sorted(
+            position for position, total in shared.items()
+            if total >= threshold
+        )
+
+    def match(self, name, limit, ratio=SIMILARITY_RATIO):
+        """Поиск городов, похожих на запрос пользователя
+
+        Лучшие совпадения отбираются ограниченной кучей размера limit.
+
+        :param str name: Нормализованное наименование города
+        :param int limit: Максимальное количество городов
+        :param float ratio: Минимальная степень сходства
+        :return: Города в порядке убывания сходства
+        :rtype: list
+        """
+        scored = []
+        matcher = SequenceMatcher(None, name)
+        for position in self.candidates(name):
+            matcher.set_seq2(self.cities[position].name_normalized)
+            if (matcher.real_quick_ratio() > ratio
+                    and matcher.quick_ratio() > ratio):
+                score = matcher.ratio()
+                if score > ratio:
+                    scored.append((score, -position))
+        best = heapq.nlargest(limit, scored)
+        return [self.cities[-negated] for _, negated in best]
+
+
+class CityVersion:
+    """Версия справочника городов, общая для всех процессов бота
+
+    Версия хранится в кэше Django. Процесс сверяет ее со своей не чаще
+    раза в interval секунд, поэтому проверка не добавляет обращений
+    к кэшу на каждый запрос пользователя.
+
+    :param str cache_alias: Кэш из CACHES (общий для процессов)
+    :param float interval: Период сверки версии в секундах
+    """
+
+    def __init__(self, cache_alias, interval):
+        self.cache_alias = cache_alias
+        self.interval = interval
+        self.current = None
+        self.checked = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def bump(self):
+        """Смена версии (после изменения таблицы городов)"""
+        version = uuid.uuid4().hex
+        self.cache.set(CITY_VERSION_KEY, version, None)
+        with self._lock:
+            self.current = version
+            self.checked = time.monotonic()
+
+    def is_stale(self):
+        """Проверка изменения справочника другим процессом
+
+        :return: True, если версия изменилась с прошлой сверки
+        :rtype: bool
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self.checked < self.interval:
+                return False
+            self.checked = now
+        version = self.cache.get(CITY_VERSION_KEY)
+        with self._lock:
+            stale = version != self.current
+            self.current = version
+        return stale
+
+
+city_version = CityVersion(
+    cache_alias=settings.CITY_VERSION_CACHE,
+    interval=settings.CITY_VERSION_INTERVAL
+)
+
+
+class CityRegistry:
+    """Реестр городов в памяти процесса
+
+    Города загружаются из БД при первом обращении и далее берутся
+    из памяти. При построении индекса триграмм в реестр попадают
+    все города сразу. Реестр сбрасывается сигналами при изменении городов
+    и при смене версии справочника другим процессом (city_version).
+    """
+
+    def __init__(self):
+        self._cities = {}
+        self._unset = None
+        self._lock = threading.Lock()
+
+    def add(self, cities):
+        """Добавление городов в реестр
+
+        :param cities: Города
+        """
+        with self._lock:
+            self._cities.update((city.pk, city) for city in cities)
+
+    def get(self, pk):
+        """Получение города по pk
+
+        :param pk: pk города (None - город не указан)
+        :return: Город или None
+        :rtype: City
+        :raise City.DoesNotExist: Город отсутствует в БД
+        """
+        if pk is None:
+            return None
+        refresh_city_search()
+        with self._lock:
+            city = self._cities.get(int(pk))
+        if city is None:
+            city = City.objects.get(pk=pk)
+            self.add([city])
+        return city
+
+    def get_many(self, pks):
+        """Получение нескольких городов по pk
+
+        Отсутствующие в реестре города загружаются одним запросом.
+
+        :param list pks: pk городов
+        :return: Словарь {pk: город} (как QuerySet.in_bulk)
+        :rtype: dict
+        """
+        refresh_city_search()
+        with self._lock:
+            cities = {
+                pk: self._cities[pk] for pk in pks if pk in self._cities
+            }
+        missing = [pk for pk in pks if pk not in cities]
+        if missing:
+            loaded = City.objects.in_bulk(missing)
+            self.add(loaded.values())
+            cities.update(loaded)
+        return cities
+
+    def get_unset(self):
+        """Получение города-заглушки "Город не установлен"
+
+        :rtype: City
+        :raise City.DoesNotExist: Заглушка отсутствует в БД
+        """
+        refresh_city_search()
+        unset = self._unset
+        if unset is None:
+            unset = City.objects.get(name=UNSET_CITY_NAME)
+            self.add([unset])
+            self._unset = unset
+        return unset
+
+    def clear(self):
+        """Сброс реестра"""
+        with self._lock:
+            self._cities = {}
+            self._unset = None
+
+
+city_registry = CityRegistry()
+
+_city_index = None
+_city_index_lock = threading.Lock()
+
+
+def get_city_index():
+    """Получение индекса городов (строится при первом обращении)
+
+    :return: Индекс триграмм по всем городам
+    :rtype: CityIndex
+    """
+    global _city_index
+    refresh_city_search()
+    if _city_index is None:
+        with _city_index_lock:
+            if _city_index is None:
+                cities = list(City.objects.order_by('pk'))
+                city_registry.add(cities)
+                _city_index = CityIndex(cities)
+    return _city_index
+
+
+def find_cities_memory(name, limit):
+    """Поиск городов по индексу триграмм в памяти процесса
+
+    :param str name: Нормализованное наименование города
+    :param int limit: Максимальное количество городов
+    :return: Города со степенью сходства более 0.8
+    :rtype: list
+    """
+    return get_city_index().match(name, limit)
+
+
+def find_cities_postgres(name, limit):
+    """Поиск городов средствами pg_trgm
+
+    Оператор % отбирает строки по GIN-индексу (порог задается
+    pg_trgm.similarity_threshold, по умолчанию 0.3), затем строки
+    дополнительно отсекаются по CITY_TRIGRAM_SIMILARITY.
+
+    :param str name: Нормализованное наименование города
+    :param int limit: Максимальное количество городов
+    :return: Города в порядке убывания сходства
+    :rtype: list
+    """
+    return list(
+        City.objects
+        .annotate(similarity=TrigramSimilarity('name_normalized', name))
+        .filter(
+            name_normalized__trigram_similar=name,
+            similarity__gt=settings.CITY_TRIGRAM_SIMILARITY
+        )
+        .order_by('-similarity', 'pk')[:limit]
+    )
+
+
+CITY_SEARCH_BACKENDS = {
+    'memory': find_cities_memory,
+    'postgres': find_cities_postgres,
+}
+
+
+def find_cities_normalized(name, limit):
+    """Поиск городов по индексу нормализованного наименования
+
+    Запрос латиницей сравнивается с транслитерацией наименования.
+    Сначала ищется точное совпадение, затем совпадение по началу строки.
+
+    :param str name: Нормализованное наименование города от пользователя
+    :param int limit: Максимальное количество городов
+    :return: Найденные города (короткие наименования первыми)
+    :rtype: list
+    """
+    if not name:
+        return []
+    cities = City.objects.order_by(Length('name_normalized'), 'pk')
+    exact = list(
+        cities.filter(Q(name_normalized=name) | Q(name_latin=name))[:limit]
+    )
+    if exact:
+        return exact
+    return list(cities.filter(
+        Q(name_normalized__startswith=name) | Q(name_latin__startswith=name)
+    )[:limit])
+
+
+def find_cities(name):
+    """Поиск городов по наименованию от пользователя
+
+    Нечеткий поиск выполняется, только если не найдено совпадений
+    по нормализованному наименованию.
+
+    :param str name: Наименование города от пользователя
+    :return: Не более CITY_SEARCH_LIMIT городов по убыванию сходства
+    :rtype: list
+    """
+    limit = settings.CITY_SEARCH_LIMIT
+    normalized = normalize_city_name(name)
+    if not normalized:
+        return []
+    cities = find_cities_normalized(normalized, limit)
+    if cities:
+        return cities
+    backend = CITY_SEARCH_BACKENDS[settings.CITY_SEARCH_BACKEND]
+    return backend(normalized, limit)
+
+
+city_cache = LRUCache(
+    maxsize=settings.CITY_CACHE_SIZE,
+    ttl=settings.CITY_CACHE_TTL
+)
+
+
+def search_cities(name, is_search):
+    """Поиск городов с кэшированием результата
+
+    Ключ кэша - нормализованный запрос и признак поиска,
+    значение - pk найденных городов в порядке ранжирования.
+
+    :param str name: Наименование города от пользователя
+    :param bool is_search: Поиск для профиля или поиска пользователей
+    :return: pk городов по убыванию сходства
+    :rtype: list
+    """
+    refresh_city_search()
+    key = (normalize_city_name(name), is_search)
+    pks = city_cache.get(key)
+    if pks is None:
+        pks = [city.pk for city in find_cities(name)]
+        city_cache.set(key, pks)
+    return pks
+
+
+def clear_city_search():
+    """Сброс кэша запросов, индекса триграмм и реестра городов
+    в текущем процессе
+    """
+    global _city_index
+    city_cache.clear()
+    city_registry.clear()
+    with _city_index_lock:
+        _city_index = None
+
+
+def refresh_city_search():
+    """Сброс данных о городах, если справочник изменил другой процесс"""
+    if city_version.is_stale():
+        clear_city_search()
+
+
+def invalidate_city_search():
+    """Сброс данных о городах во всех процессах бота
+
+    Вызывается после изменения таблицы городов. Текущий процесс
+    сбрасывает данные сразу, остальные - при сверке версии.
+    """
+    city_version.bump()
+    clear_city_search()
+
+
+def save_ranking(pks, is_search):
+    """Сохранение результатов поиска для постраничного вывода
+
+    :param list pks: pk городов в порядке убывания сходства
+    :param bool is_search: Поиск для профиля или поиска пользователей
+    :return: Ключ сохраненного результата
+    :rtype: str
+    """
+    token = uuid.uuid4().hex[:12]
+    caches[settings.CITY_RANKING_CACHE].set(
+        CITY_RANKING_KEY.format(token=token), (pks, is_search),
+        settings.CITY_RANKING_TTL
+    )
+    return token
+
+
+def get_ranking(token):
+    """Получение сохраненного результата поиска
+
+    :param str token: Ключ результата
+    :return: pk городов и признак поиска или None, если результат устарел
+    :rtype: tuple or None
+    """
+    return caches[settings.CITY_RANKING_CACHE].get(
+        CITY_RANKING_KEY.format(token=token)
+    )
@@ -0,0 +1,80 @@
+"""dedupe.py - Отбрасывание повторно доставленных обновлений
+
+Если вебхук отвечает медленно, Telegram повторяет доставку того же
+обновления. Полученные update_id хранятся TELEGRAM_DEDUPE_WINDOW секунд
+в памяти процесса и, если задан TELEGRAM_DEDUPE_CACHE, в общем кэше
+Django (например, Redis), чтобы повтор, пришедший в другой процесс,
+тоже был отброшен.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import LRUCache
+
+
+class UpdateDeduplicator:
+    """Учет полученных обновлений в ограниченном временном окне
+
+    :param int window: Время хранения update_id в секундах
+    :param int maxsize: Количество update_id в памяти процесса
+    :param str cache_alias: Общий кэш из CACHES (None - только память)
+    """
+
+    def __init__(self, window, maxsize, cache_alias=None):
+        self.window = window
+        self.cache_alias = cache_alias
+        self.duplicates = 0
+        self._seen = LRUCache(maxsize=maxsize, ttl=window)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(update_id):
+        return f'tgbot:update:{update_id}'
+
+    def is_duplicate(self, update_id):
+        """Регистрация обновления
+
+        :param int update_id: Id обновления
+        :return: True, если обновление уже было получено
+        :rtype: bool
+        """
+        duplicate = not self._seen.add(update_id, True)
+        if not duplicate and self.cache_alias is not None:
+            duplicate = not caches[self.cache_alias].add(
+                self.get_key(update_id), True, self.window
+            )
+        if duplicate:
+            with self._lock:
+                self.duplicates += 1
+        return duplicate
+
+    def forget(self, update_id):
+        """Отмена регистрации (обновление не принято в обработку)
+
+        :param int update_id: Id обновления
+        """
+        self._seen.delete(update_id)
+        if self.cache_alias is not None:
+            caches[self.cache_alias].delete(self.get_key(update_id))
+
+    def stats(self):
+        """Счетчики отброшенных повторов
+
+        :return: Количество повторов и update_id в памяти процесса
+        :rtype: dict
+        """
+        with self._lock:
+            duplicates = self.duplicates
+        return {
+            'duplicates': duplicates,
+            'size': self._seen.stats()['size'],
+        }
+
+
+update_dedupe = UpdateDeduplicator(
+    window=settings.TELEGRAM_DEDUPE_WINDOW,
+    maxsize=settings.TELEGRAM_DEDUPE_SIZE,
+    cache_alias=settings.TELEGRAM_DEDUPE_CACHE
+)
@@ -3,20 +3,60 @@
 import functools
 import logging
 import os
-from difflib import SequenceMatcher
 
 import telebot
-from telebot import types
+from telebot import apihelper, types
+from telebot.apihelper import ApiTelegramException
 
 from django.conf import settings
 
-from .models import City, Profile, ProfileSearch, User
-
-bot = telebot.TeleBot(settings.TELEGRAM_TOKEN)
+from .cities import city_registry, get_ranking, save_ranking, search_cities
+from .media import is_file_id_rejected, send_static_media
+from .models import Profile, ProfileSearch, User, save_changes
+from .outbox import Outbox
+from .search import find_next_search_profile
+from .session import create_session
+from .steps import StepHandlerBackend, step_storage
+from .throttling import rate_limiter
+from .users import forget_user, get_user, user_context
+
+step_backend = StepHandlerBackend(step_storage)
+bot = telebot.TeleBot(
+    settings.TELEGRAM_TOKEN,
+    threaded=False,
+    next_step_backend=step_backend
+)
+# Без пула обработчиков к Telegram обращаются потоки веб-сервера,
+# количество которых заранее неизвестно: пул не блокирует их
+apihelper.session = create_session(
+    pool_size=settings.TELEGRAM_POOL_SIZE,
+    block=settings.TELEGRAM_WORKERS > 0,
+    http2=settings.TELEGRAM_HTTP2
+)
+apihelper.SESSION_TIME_TO_LIVE = None
+apihelper.CONNECT_TIMEOUT = settings.TELEGRAM_CONNECT_TIMEOUT
+apihelper.READ_TIMEOUT = settings.TELEGRAM_READ_TIMEOUT
+outbox = Outbox(bot, rate_limiter.request)
+apihelper.CUSTOM_REQUEST_SENDER = outbox.request
+# Типы обновлений, для которых есть обработчики
+ALLOWED_UPDATES = ['message', 'callback_query']
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger()
 
 
+def process_update(update, reply=None):
+    """Обработка обновления от Telegram
+
+    Все обработчики обновления используют одного загруженного
+    пользователя (get_user), исходящие вызовы объединяются (outbox).
+
+    :param Update update: Обновление от Telegram
+    :param WebhookReply reply: Слот ответа на вебхук
+    """
+    with user_context():
+        outbox.process_update(update, reply)
+
+
 def log(func):
     """Декоратор для логирования исключений кода"""
     @functools.wraps(func)
@@ -41,16 +81,48 @@ def gen_markup_for_city(name, is_search):
     :return: Inline-клавиатура
     :rtype: InlineKeyboardMarkup
     """
+    pks = search_cities(name, is_search)
+    token = None
+    if len(pks) > settings.CITY_SUGGESTIONS:
+        token = save_ranking(pks, is_search)
+    return gen_markup_for_city_page(pks, is_search, token)
+
+
+@log
+def gen_markup_for_city_page(pks, is_search, token, offset=0):
+    """Генерация страницы клавиатуры для списка городов
+
+    :param list pks: pk городов в порядке убывания сходства
+    :param bool is_search: Генерация для профиля или поиска пользователей
+    :param token: Ключ сохраненного результата поиска (для пролистывания)
+    :param int offset: Номер первого города на странице
+    :return: Inline-клавиатура
+    :rtype: InlineKeyboardMarkup
+    """
     markup = types.InlineKeyboardMarkup()
     markup.row_width = 2
-    cities = City.objects.all()
-    for city in cities:
-        if SequenceMatcher(None, name, city.name).ratio() > 0.8:
-            callback = 'search_' if is_search else ''
-            markup.add(types.InlineKeyboardButton(
-                text=f"{city.name}, {city.region}",
-                callback_data=f"city_{callback}{city.pk}"
-            ))
+    page_size = settings.CITY_SUGGESTIONS
+    callback = 'search_' if is_search else ''
+    page = pks[offset:offset + page_size]
+    cities = city_registry.get_many(page)
+    for city in filter(None, map(cities.get, page)):
+        markup.add(types.InlineKeyboardButton(
+            text=f"{city.name}, {city.region}",
+            callback_data=f"city_{callback}{city.pk}"
+        ))
+    buttons = []
+    if offset > 0:
+        buttons.append(types.InlineKeyboardButton(
+            text="⬅️Назад",
+            callback_data=f"city_more_{token}_{max(offset - page_size, 0)}"
+        ))
+    if offset + page_size < len(pks):
+        buttons.append(types.InlineKeyboardButton(
+            text="➡️Ещё",
+            callback_data=f"city_more_{token}_{offset + page_size}"
+        ))
+    if buttons:
+        markup.add(*buttons)
     markup.add(types.InlineKeyboardButton(
         text="🤷🏻‍♂️Города нет в списке",
         callback_data="city_empty"
@@ -228,6 +300,42 @@ def get_user_avatar(user):
         return avatar
 
 
+@log
+def send_user_avatar(chat_id, user, **kwargs):
+    """Отправка фото профиля пользователя
+
+    Фото отправляется по file_id, сохраненному после первой загрузки
+    в Telegram. Файл с диска загружается, только если file_id еще нет
+    или Telegram его не принял.
+
+    :param int chat_id: Получатель сообщения
+    :param User user: Пользователь, чье фото отправляется
+    :param kwargs: Параметры send_photo (caption, reply_markup и т.д.)
+    :return: Отправленное сообщение
+    :rtype: Message
+    """
+    profile = user.profile
+    if profile.avatar_file_id:
+        try:
+            return bot.send_photo(
+                chat_id=chat_id,
+                photo=profile.avatar_file_id,
+                **kwargs
+            )
+        except ApiTelegramException as e:
+            if not is_file_id_rejected(e):
+                raise
+            logger.warning(f'Avatar file_id of {user.chat_id} rejected')
+    message = bot.send_photo(
+        chat_id=chat_id,
+        photo=get_user_avatar(user),
+        **kwargs
+    )
+    profile.avatar_file_id = message.photo[-1].file_id
+    profile.save(update_fields=['avatar_file_id'])
+    return message
+
+
 @log
 def get_user_profile(user):
     """Получение профиля текущего пользователя
@@ -240,16 +348,16 @@ def get_user_profile(user):
         text += '<b>🚹Пол: </b> Мужчина\n'
     else:
         text += '<b>🚺Пол: </b> Женщина\n'
-    if user.profile.city is None:
+    if user.profile.city_id is None:
         text += '<b>🏠Город: </b>Не установлен\n'
     else:
-        text += f'<b>🏠Город: </b>{user.profile.city}\n'
+        text += f'<b>🏠Город: </b>{city_registry.get(user.profile.city_id)}\n'
     text += f'<b>🖌️Описание: </b>{user.profile.description}\n\n'
     text += '<i>Так выглядит ваш профиль</i>\n'
     text += 'Вы можете изменить следующие параметры:'
-    bot.send_photo(
+    send_user_avatar(
         chat_id=user.chat_id,
-        photo=get_user_avatar(user),
+        user=user,
         caption=text,
         reply_markup=gen_markup_for_profile(user),
         parse_mode='HTML'
@@ -270,10 +378,11 @@ def get_user_profile_search(user):
         text += '<b>🚹Пол: </b> Мужчина\n'
     else:
         text += '<b>🚺Пол: </b> Женщина\n'
-    if user.profile.city is None:
+    if user.profile.city_id is None:
         text += '<b>🏠Город: </b>Не установлен\n'
     else:
-        text += f'<b>🏠Город: </b>{user.profilesearch.city}\n\n'
+        city = city_registry.get(user.profilesearch.city_id)
+        text += f'<b>🏠Город: </b>{city}\n\n'
     text += 'Вы можете изменить настройки поиска: '
 
     return text
@@ -284,33 +393,9 @@ def get_next_search_profile(client):
     """Получение очередного собеседника в соответствии с настройками поиска
 
     :param User client: Текущий пользователь бота
-    :raise IndexError: Отсутствие пользователей согласно настройкам поиска
     """
-    try:
-        user_id = client.profilesearch.unviewed.pop()
-        user = User.objects.get(chat_id=user_id)
-        text = f'<b>{user.profile.name}, </b>'
-        text += f'{user.profile.age}, '
-        text += f'{user.profile.city.name}\n'
-        text += f'<i>{user.profile.description}</i>'
-        markup = types.InlineKeyboardMarkup()
-        markup.row_width = 1
-        markup.add(
-            types.InlineKeyboardButton(
-                text='💌 Написать',
-                url=f'tg://user?id={user.chat_id}'
-            )
-        )
-        bot.send_photo(
-            chat_id=client.chat_id,
-            photo=get_user_avatar(user),
-            caption=text,
-            reply_markup=markup,
-            parse_mode='HTML'
-        )
-        client.profilesearch.viewed.append(user_id)
-        client.profilesearch.save()
-    except IndexError:
+    profile = find_next_search_profile(client)
+    if profile is None:
         text = 'К сожалению, мы никого <b>не нашли</b>\n'
         text += 'Попробуйте изменить настройки поиска'
         bot.send_message(
@@ -318,6 +403,27 @@ def get_next_search_profile(client):
             text=text,
             parse_mode='HTML'
         )
+        return
+    user = profile.user
+    text = f'<b>{profile.name}, </b>'
+    text += f'{profile.age}, '
+    text += f'{city_registry.get(profile.city_id).name}\n'
+    text += f'<i>{profile.description}</i>'
+    markup = types.InlineKeyboardMarkup()
+    markup.row_width = 1
+    markup.add(
+        types.InlineKeyboardButton(
+            text='💌 Написать',
+            url=f'tg://user?id={user.chat_id}'
+        )
+    )
+    send_user_avatar(
+        chat_id=client.chat_id,
+        user=user,
+        caption=text,
+        reply_markup=markup,
+        parse_mode='HTML'
+    )
 
 
 @bot.message_handler(commands=['start'])
@@ -330,18 +436,24 @@ def start_message(message):
 
     :param Message message: Сообщение от пользователя
     """
-    sticker_path = os.path.join(
-        settings.STATIC_ROOT, 'tgbot/images/welcome.webp'
+    send_static_media(
+        bot.send_sticker,
+        message.chat.id,
+        'tgbot/images/welcome.webp'
     )
-    with open(sticker_path, 'rb') as sticker:
-        bot.send_sticker(message.chat.id, sticker.read())
-    user, created = User.objects.get_or_create(chat_id=message.chat.id)
+    try:
+        user = get_user(message.chat.id)
+        created = False
+    except User.DoesNotExist:
+        user = User.objects.create(chat_id=message.chat.id)
+        created = True
     if created or not user.profile.is_registered:
         user.first_name = message.chat.first_name
         user.username = message.chat.username
         user.save()
         Profile.objects.create(user=user)
         ProfileSearch.objects.create(user=user)
+        forget_user(user.chat_id)
         text = '<b>Приветик☺</b>\n\n'
         text += 'Чтобы начать знакомства, необходимо завести анкету.\n'
 
@@ -378,7 +490,7 @@ def show_user_profile(message):
     :raise User.DoesNotExist: Если пользователь не начинал регистрацию
     """
     try:
-        user = User.objects.get(chat_id=message.chat.id)
+        user = get_user(message.chat.id)
         if user.profile.is_registered:
             get_user_profile(user)
         else:
@@ -429,7 +541,7 @@ def bot_message(message):
         if message.text == '😎Мой профиль':
             show_user_profile(message)
         if message.text == '⚙Настройки поиска':
-            user = User.objects.get(chat_id=message.chat.id)
+            user = get_user(message.chat.id)
             bot.send_message(
                 chat_id=user.chat_id,
                 text=get_user_profile_search(user),
@@ -437,41 +549,24 @@ def bot_message(message):
                 parse_mode='HTML'
             )
         if message.text == '🔍Поиск':
-            client = User.objects.get(chat_id=message.chat.id)
-            if not client.profilesearch.unviewed:
-                start_age, end_age = map(
-                    int,
-                    client.profilesearch.age.split('-')
-                )
-                list_users_for_search = User.objects.filter(
-                    profile__age__range=(start_age, end_age),
-                    profile__sex=client.profilesearch.sex,
-                    profile__city=client.profilesearch.city
-                ).exclude(chat_id=client.chat_id).order_by('?')
-
-                for user in list_users_for_search:
-                    if (user.chat_id not in client.profilesearch.viewed and
-                            user.chat_id not in client.profilesearch.unviewed):
-                        client.profilesearch.unviewed.append(user.chat_id)
-                client.profilesearch.save()
-
-            get_next_search_profile(client)
+            get_next_search_profile(get_user(message.chat.id))
 
 
+@step_backend.step('name')
 @log
-def process_name_step(message, user):
+def process_name_step(message):
     """Шаг в цепочке регистрации пользователя (указание имени)
 
     :param Message message: Сообщение от пользователя
-    :param User user: Текущий пользователь
     """
+    user = get_user(message.chat.id)
     name = message.text
     if len(name) > 20:
         bot.reply_to(
             message=message,
             text='Ваше имя слишком длинное, используйте до 20 сим.'
         )
-        bot.register_next_step_handler(message, process_name_step, user)
+        bot.register_next_step_handler(message, process_name_step)
         return
     user.profile.name = name
     user.profile.save()
@@ -480,23 +575,24 @@ def process_name_step(message, user):
         show_user_profile(message)
     else:
         message = bot.reply_to(message, 'Сколько вам лет?')
-        bot.register_next_step_handler(message, process_age_step, user)
+        bot.register_next_step_handler(message, process_age_step)
 
 
+@step_backend.step('age')
 @log
-def process_age_step(message, user):
+def process_age_step(message):
     """Шаг в цепочке регистрации пользователя (указание возраста)
 
     :param Message message: Сообщение от пользователя
-    :param User user: Текущий пользователь
     """
+    user = get_user(message.chat.id)
     age = message.text
     if not age.isdigit() or not 13 <= int(age) <= 100:
         message = bot.reply_to(
             message=message,
             text='Укажите возраст цифрами от 13 до 100'
         )
-        bot.register_next_step_handler(message, process_age_step, user)
+        bot.register_next_step_handler(message, process_age_step)
         return
     user.profile.age = age
     user.profile.save()
@@ -512,16 +608,17 @@ def process_age_step(message, user):
             text='Укажите ваш пол',
             reply_markup=markup
         )
-        bot.register_next_step_handler(message, process_sex_step, user)
+        bot.register_next_step_handler(message, process_sex_step)
 
 
+@step_backend.step('sex')
 @log
-def process_sex_step(message, user):
+def process_sex_step(message):
     """Шаг в цепочке регистрации пользователя (указание пола)
 
     :param Message message: Сообщение от пользователя
-    :param User user: Текущий пользователь
     """
+    user = get_user(message.chat.id)
     sex = message.text
     if sex == 'Мужчина':
         user.profile.sex = 'M'
@@ -534,10 +631,9 @@ def process_sex_step(message, user):
             message=message,
             text='Выберите пол из предложенных вариантов (Мужчина / Женщина)'
         )
-        bot.register_next_step_handler(message, process_sex_step, user)
+        bot.register_next_step_handler(message, process_sex_step)
         return
-    user.profile.save()
-    user.profilesearch.save()
+    save_changes(user.profile, user.profilesearch)
     if user.profile.is_registered:
         bot.send_message(
             chat_id=message.chat.id,
@@ -558,6 +654,7 @@ def process_sex_step(message, user):
         bot.register_next_step_handler(message, process_city_step)
 
 
+@step_backend.step('city')
 @log
 def process_city_step(message, is_search=False):
     """Шаг в цепочке регистрации пользователя (указание города)
@@ -580,21 +677,21 @@ def process_city_step(message, is_search=False):
     )
 
 
+@step_backend.step('description')
 @log
-def process_description_step(message, user):
+def process_description_step(message):
     """Шаг в цепочке регистрации пользователя (указание описания профиля)
 
     :param Message message: Сообщение от пользователя
-    :param User user: Текущий пользователь
     """
+    user = get_user(message.chat.id)
     description = message.text
     if len(description) > 400:
         message = bot.reply_to(
             message=message,
             text='Слишком длинное описание, до 400 сим.'
         )
-        bot.register_next_step_handler(message, process_description_step,
-                                       user)
+        bot.register_next_step_handler(message, process_description_step)
         return
     user.profile.description = description
     user.profile.save()
@@ -603,17 +700,18 @@ def process_description_step(message, user):
         show_user_profile(message)
     else:
         message = bot.reply_to(message, 'Пришлите ваше фото')
-        bot.register_next_step_handler(message, process_photo_step, user)
+        bot.register_next_step_handler(message, process_photo_step)
 
 
+@step_backend.step('photo')
 @log
-def process_photo_step(message, user):
+def process_photo_step(message):
     """Шаг в цепочке регистрации пользователя (загрузка фото профиля)
 
     :param Message message: Сообщение от пользователя
-    :param User user: Текущий пользователь
     :raise TypeError: В случае, если в ТГ отправляется не фото
     """
+    user = get_user(message.chat.id)
     try:
         file_id = message.photo[-1].file_id
         file = bot.get_file(file_id)
@@ -625,6 +723,8 @@ def process_photo_step(message, user):
         with open(complete_name, "wb") as img:
             img.write(user_avatar)
 
+        user.profile.avatar_file_id = file_id
+        user.profile.save(update_fields=['avatar_file_id'])
         bot.send_message(chat_id=message.chat.id, text='Фото установлено!')
 
         if user.profile.is_registered:
@@ -646,9 +746,10 @@ def process_photo_step(message, user):
             message=message,
             text='Поддерживаемый формат: PNG/JPG\n(compress/сжатое)'
         )
-        bot.register_next_step_handler(message, process_photo_step, user)
+        bot.register_next_step_handler(message, process_photo_step)
 
 
+@step_backend.step('bug')
 @log
 def process_bug_step(message):
     """Логирование сообщения об ошибке в боте от пользователя
@@ -667,51 +768,85 @@ def process_bug_step(message):
     logging.warning(f'BUG from {message.chat.id}: {bug}')
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('city_'))
+@bot.callback_query_handler(
+    func=lambda call: call.data.startswith('city_more_'))
+@log
+def callback_more_cities(call):
+    """Пролистывание списка городов
+
+    Используется сохраненный результат поиска, повторный поиск
+    не выполняется.
+
+    :param call: Callback от inline-клавиши
+    """
+    token, offset = call.data.split('_')[-2:]
+    ranking = get_ranking(token)
+    if ranking is None:
+        outbox.answer_callback_query(
+            call.id,
+            'Список устарел, укажите город еще раз'
+        )
+        return
+    pks, is_search = ranking
+    outbox.edit_message(
+        chat_id=call.from_user.id,
+        message_id=call.message.message_id,
+        reply_markup=gen_markup_for_city_page(
+            pks, is_search, token, int(offset)
+        )
+    )
+    outbox.answer_callback_query(call.id)
+
+
+@bot.callback_query_handler(
+    func=lambda call: (call.data.startswith('city_')
+                       and not call.data.startswith('city_more_')))
 @log
 def callback_set_city(call):
     """Установка города в профиль пользователя или в настройки поиска
 
     :param call: Callback от inline-клавиши
     """
-    bot.edit_message_reply_markup(call.from_user.id, call.message.message_id)
+    outbox.edit_message(
+        chat_id=call.from_user.id,
+        message_id=call.message.message_id,
+        reply_markup=None
+    )
 
-    user = User.objects.get(chat_id=call.from_user.id)
+    user = get_user(call.from_user.id)
     if call.data == 'city_empty':
         text = 'Пожалуйста, <b>свяжитесь с администратором бота</b>\n'
         text += 'Для этого воспользутей командой /bug и сообщите о проблеме'
-        if user.profile.city is None:
-            user.profile.city = City.objects.get(
-                name='Город не установлен')
+        if user.profile.city_id is None:
+            user.profile.city = city_registry.get_unset()
             user.profilesearch.city = user.profile.city
     else:
         city_pk = call.data.split('_')[-1]
         if call.data.startswith('city_search'):
-            user.profilesearch.city = City.objects.get(pk=city_pk)
-            user.profilesearch.unviewed.clear()
+            user.profilesearch.city = city_registry.get(city_pk)
+            user.profilesearch.reset_queue()
             text = '<b>Город собеседника установлен</b>\n'
         else:
-            user.profile.city = City.objects.get(pk=city_pk)
+            user.profile.city = city_registry.get(city_pk)
             user.profilesearch.city = user.profile.city
             text = '<b>Город установлен</b>\n'
 
-    user.profile.save()
-    user.profilesearch.save()
+    save_changes(user.profile, user.profilesearch)
 
-    bot.edit_message_text(
+    outbox.edit_message(
         chat_id=call.from_user.id,
         message_id=call.message.message_id,
         text=text,
         parse_mode='HTML'
     )
-    bot.answer_callback_query(call.id)
+    outbox.answer_callback_query(call.id)
 
     if not user.profile.is_registered:
         message = bot.send_message(
             chat_id=call.from_user.id,
             text='Укажите описание о себе до 400 сим.'
         )
-        bot.register_next_step_handler(message, process_description_step, user)
+        bot.register_next_step_handler(message, process_description_step)
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('profile_'))
@@ -726,21 +861,21 @@ def callback_change_profile(call):
     :raise User.DoesNotExist: Доступ в профиль при отсутствии регистрации
     """
     try:
-        bot.edit_message_reply_markup(
+        outbox.edit_message(
             chat_id=call.from_user.id,
-            message_id=call.message.message_id
+            message_id=call.message.message_id,
+            reply_markup=None
         )
 
-        user = User.objects.get(chat_id=call.from_user.id)
+        user = get_user(call.from_user.id)
 
         if call.data == 'profile_registration':
             bot.send_message(
                 chat_id=call.from_user.id,
                 text="Как вас зовут?"
             )
-            bot.register_next_step_handler(call.message, process_name_step,
-                                           user)
-            bot.answer_callback_query(call.id)
+            bot.register_next_step_handler(call.message, process_name_step)
+            outbox.answer_callback_query(call.id)
             return
 
         if call.data == 'profile_edit_name':
@@ -748,18 +883,16 @@ def callback_change_profile(call):
                 chat_id=call.from_user.id,
                 text="Укажите ваше имя:"
             )
-            bot.register_next_step_handler(call.message, process_name_step,
-                                           user)
-            bot.answer_callback_query(call.id)
+            bot.register_next_step_handler(call.message, process_name_step)
+            outbox.answer_callback_query(call.id)
             return
         if call.data == 'profile_edit_age':
             bot.send_message(
                 chat_id=call.from_user.id,
                 text="Укажите ваш возраст:"
             )
-            bot.register_next_step_handler(call.message, process_age_step,
-                                           user)
-            bot.answer_callback_query(call.id)
+            bot.register_next_step_handler(call.message, process_age_step)
+            outbox.answer_callback_query(call.id)
             return
         if call.data == 'profile_edit_sex':
             markup = types.ReplyKeyboardMarkup(one_time_keyboard=True,
@@ -770,9 +903,8 @@ def callback_change_profile(call):
                 text="Укажите ваш пол:",
                 reply_markup=markup
             )
-            bot.register_next_step_handler(call.message, process_sex_step,
-                                           user)
-            bot.answer_callback_query(call.id)
+            bot.register_next_step_handler(call.message, process_sex_step)
+            outbox.answer_callback_query(call.id)
             return
         if call.data == 'profile_edit_city':
             bot.send_message(
@@ -780,7 +912,7 @@ def callback_change_profile(call):
                 text="Укажите ваш город:"
             )
             bot.register_next_step_handler(call.message, process_city_step)
-            bot.answer_callback_query(call.id)
+            outbox.answer_callback_query(call.id)
             return
         if call.data == 'profile_edit_description':
             bot.send_message(
@@ -788,28 +920,26 @@ def callback_change_profile(call):
                 text="Укажите описание:"
             )
             bot.register_next_step_handler(call.message,
-                                           process_description_step,
-                                           user)
-            bot.answer_callback_query(call.id)
+                                           process_description_step)
+            outbox.answer_callback_query(call.id)
             return
         if call.data == 'profile_edit_avatar':
             bot.send_message(
                 chat_id=call.from_user.id,
                 text="Пришлите ваше фото:"
             )
-            bot.register_next_step_handler(call.message, process_photo_step,
-                                           user)
-            bot.answer_callback_query(call.id)
+            bot.register_next_step_handler(call.message, process_photo_step)
+            outbox.answer_callback_query(call.id)
             return
         if call.data == 'profile_edit_active':
             user.profile.is_active = not user.profile.is_active
             user.profile.save()
             show_user_profile(call.message)
-            bot.answer_callback_query(call.id, 'Статус анкеты изменен')
+            outbox.answer_callback_query(call.id, 'Статус анкеты изменен')
             return
 
     except User.DoesNotExist:
-        bot.edit_message_text(
+        outbox.edit_message(
             chat_id=call.from_user.id,
             message_id=call.message.message_id,
             text="Вы не завели анкету!\nВоспользуйтесь командой:\n/start"
@@ -825,16 +955,16 @@ def callback_change_profile_search(call):
     :raise User.DoesNotExist: Доступ к настройкам при отсутствии регистрации
     """
     try:
-        user = User.objects.get(chat_id=call.from_user.id)
+        user = get_user(call.from_user.id)
         text = markup = None
 
         if call.data == 'search_age':
             text = '<b>Выберите возрастной диапозон</b>: '
             markup = gen_markup_for_age_search()
-            bot.answer_callback_query(call.id)
+            outbox.answer_callback_query(call.id)
         if call.data.startswith('search_age_'):
             user.profilesearch.age = call.data.split('_')[-1]
-            user.profilesearch.unviewed.clear()
+            user.profilesearch.reset_queue()
             user.profilesearch.save()
             text = get_user_profile_search(user)
             markup = gen_markup_for_profile_search()
@@ -844,7 +974,7 @@ def callback_change_profile_search(call):
             markup = gen_markup_for_sex_search()
         if call.data.startswith('search_sex_'):
             user.profilesearch.sex = call.data.split('_')[-1]
-            user.profilesearch.unviewed.clear()
+            user.profilesearch.reset_queue()
             user.profilesearch.save()
             text = get_user_profile_search(user)
             markup = gen_markup_for_profile_search()
@@ -862,25 +992,21 @@ def callback_change_profile_search(call):
             is_search = True
             bot.register_next_step_handler(call.message, process_city_step,
                                            is_search)
-            bot.answer_callback_query(call.id)
+            outbox.answer_callback_query(call.id)
             return
 
-        bot.edit_message_text(
-            text=text,
-            chat_id=call.from_user.id,
-            message_id=call.message.message_id,
-            parse_mode='HTML'
-        )
-        bot.edit_message_reply_markup(
+        outbox.edit_message(
             chat_id=call.from_user.id,
             message_id=call.message.message_id,
+            text=text,
+            parse_mode='HTML',
             reply_markup=markup
         )
-        bot.answer_callback_query(call.id)
+        outbox.answer_callback_query(call.id)
         return
 
     except User.DoesNotExist:
-        bot.edit_message_text(
+        outbox.edit_message(
             chat_id=call.from_user.id,
             message_id=call.message.message_id,
             text="Вы не завели анкету!\nВоспользуйтесь командой:\n/start"
@@ -0,0 +1,132 @@
+"""load_cities.py - Загрузка справочника городов из cities.json
+
+Файл читается потоково, города вставляются пачками одним запросом
+INSERT ... ON CONFLICT (id) DO UPDATE, поэтому повторная загрузка
+обновляет существующие записи.
+
+Команда выполняется в отдельном процессе, поэтому запущенный бот
+узнает о загрузке по версии справочника в общем кэше CITY_VERSION_CACHE
+(не позже чем через CITY_VERSION_INTERVAL секунд). Если этот кэш
+не общий (например, кэш в памяти процесса по умолчанию), бот нужно
+перезапустить.
+"""
+import json
+import os
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from tgbot.cities import invalidate_city_search
+from tgbot.models import City
+from tgbot.utils import normalize_city_name, transliterate
+
+SEPARATORS = re.compile(r'[\s,]*')
+CHUNK_SIZE = 64 * 1024
+COLUMNS = ['id', 'name', 'region', 'name_normalized', 'name_latin']
+
+
+def iter_fixture(path):
+    """Потоковое чтение объектов из JSON-массива фикстуры
+
+    :param str path: Путь к файлу фикстуры
+    :return: Объекты фикстуры по одному
+    :rtype: Iterator[dict]
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as fixture:
+        buffer = fixture.read(CHUNK_SIZE).lstrip()
+        if not buffer.startswith('['):
+            raise CommandError(f'{path}: ожидается JSON-массив')
+        position = 1
+        while True:
+            position = SEPARATORS.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                obj, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = fixture.read(CHUNK_SIZE)
+                if not chunk:
+                    raise CommandError(f'{path}: некорректный JSON')
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield obj
+
+
+class Command(BaseCommand):
+    help = 'Загрузка справочника городов (upsert по pk)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=os.path.join(settings.BASE_DIR, 'cities.json'),
+            help='Путь к фикстуре городов'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Количество городов в одном запросе'
+        )
+
+    def handle(self, *args, **options):
+        table = City._meta.db_table
+        total = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            rows = []
+            for obj in iter_fixture(options['path']):
+                if obj.get('model') != 'tgbot.city':
+                    continue
+                fields = obj['fields']
+                normalized = normalize_city_name(fields['name'])
+                rows.append((
+                    obj['pk'],
+                    fields['name'],
+                    fields['region'],
+                    normalized,
+                    transliterate(normalized),
+                ))
+                if len(rows) >= options['batch_size']:
+                    total += self.upsert(cursor, rows)
+                    rows = []
+            if rows:
+                total += self.upsert(cursor, rows)
+            for sql in connection.ops.sequence_reset_sql(no_style(), [City]):
+                cursor.execute(sql)
+            cursor.execute(f'ANALYZE {table}')
+
+        # Запущенные процессы бота сбросят кэши городов при сверке версии
+        invalidate_city_search()
+        self.stdout.write(self.style.SUCCESS(f'Загружено городов: {total}'))
+        self.stdout.write(
+            'Процессы бота обновят города в течение '
+            f'{settings.CITY_VERSION_INTERVAL:g} сек., если кэш '
+            f'{settings.CITY_VERSION_CACHE} общий, '
+            'иначе их нужно перезапустить'
+        )
+
+    @staticmethod
+    def upsert(cursor, rows):
+        """Вставка или обновление пачки городов одним запросом
+
+        :param cursor: Курсор БД
+        :param list rows: Строки со значениями колонок COLUMNS
+        :return: Количество обработанных строк
+        :rtype: int
+        """
+        placeholders = f"({', '.join(['%s'] * len(COLUMNS))})"
+        updates = ', '.join(
+            f'{column} = EXCLUDED.{column}' for column in COLUMNS[1:]
+        )
+        cursor.execute(
+            f"INSERT INTO {City._meta.db_table} ({', '.join(COLUMNS)}) "
+            f"VALUES {', '.join([placeholders] * len(rows))} "
+            f"ON CONFLICT (id) DO UPDATE SET {updates}",
+            [value for row in rows for value in row]
+        )
+        return len(rows)
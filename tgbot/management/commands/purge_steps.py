@@ -0,0 +1,20 @@
+"""purge_steps.py - Удаление устаревших шагов диалога
+
+Шаги, сохраненные более TELEGRAM_STEP_TTL секунд назад, не обрабатываются,
+но их строки остаются в tgbot_conversationstep, если пользователь больше
+не пишет боту. Команда удаляет такие строки и выполняется по расписанию
+(например, cron раз в сутки). Для хранилища cache ничего не делает.
+"""
+from django.core.management.base import BaseCommand
+
+from tgbot.steps import step_storage
+
+
+class Command(BaseCommand):
+    help = 'Удаление устаревших шагов диалога'
+
+    def handle(self, *args, **options):
+        deleted = step_storage.purge()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено устаревших шагов: {deleted}'
+        ))
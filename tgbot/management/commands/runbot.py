@@ -0,0 +1,224 @@
+"""runbot.py - Получение обновлений через long polling (без вебхука)
+
+Обновления запрашиваются getUpdates пачками и обрабатываются тем же
+набором обработчиков, что и вебхук, через UpdateDispatcher: обновления
+разных чатов - параллельно, одного чата - по порядку.
+
+Получение обновления подтверждается Telegram при постановке в очередь,
+как при ответе на вебхук. Отдельно в файл сохраняется offset, до
+которого все обновления обработаны: после перезапуска повторно
+полученные обработанные обновления пропускаются.
+
+SIGINT и SIGTERM останавливают получение обновлений, после чего
+обрабатываются уже принятые.
+"""
+import logging
+import os
+import signal
+import threading
+import time
+
+from requests import RequestException
+from telebot import apihelper
+from telebot.apihelper import ApiException, ApiTelegramException
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tgbot.handlers import ALLOWED_UPDATES, bot, process_update
+from tgbot.session import create_session
+from tgbot.workers import UpdateDispatcher
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF = 30
+
+
+def read_offset(path):
+    """Чтение сохраненного offset
+
+    :param str path: Путь к файлу
+    :return: Offset (0 - файла нет)
+    :rtype: int
+    """
+    try:
+        with open(path) as offset_file:
+            return int(offset_file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_offset(path, offset):
+    """Атомарная запись offset (файл не остается недописанным)
+
+    :param str path: Путь к файлу
+    :param int offset: Offset
+    """
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as offset_file:
+        offset_file.write(str(offset))
+    os.replace(temp_path, path)
+
+
+class OffsetTracker:
+    """Учет полученных и обработанных обновлений
+
+    :param int offset: Первое необработанное обновление
+    """
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.pending = set()
+        self._lock = threading.Lock()
+
+    def fetched(self, update_id):
+        """Регистрация полученного обновления
+
+        :param int update_id: Id обновления
+        :return: False, если обновление уже было получено
+        :rtype: bool
+        """
+        with self._lock:
+            if update_id < self.offset:
+                return False
+            self.pending.add(update_id)
+            self.offset = update_id + 1
+            return True
+
+    def done(self, update_id):
+        """Регистрация обработанного обновления
+
+        :param int update_id: Id обновления
+        """
+        with self._lock:
+            self.pending.discard(update_id)
+
+    @property
+    def committed(self):
+        """Offset, до которого все полученные обновления обработаны"""
+        with self._lock:
+            return min(self.pending) if self.pending else self.offset
+
+
+def raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+class Command(BaseCommand):
+    help = 'Запуск бота через long polling (getUpdates)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.TELEGRAM_WORKERS,
+            help='Количество потоков обработки обновлений'
+        )
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=settings.TELEGRAM_QUEUE_SIZE,
+            help='Размер очереди одного потока'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=100,
+            help='Количество обновлений в одном запросе (не более 100)'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            default=50,
+            help='Время ожидания обновлений на стороне Telegram (сек.)'
+        )
+        parser.add_argument(
+            '--offset-file',
+            default=os.path.join(settings.BASE_DIR, '.runbot_offset'),
+            help='Файл для хранения offset обработанных обновлений'
+        )
+
+    def handle(self, *args, **options):
+        # Поток получения обновлений держит отдельное соединение
+        apihelper.session = create_session(
+            pool_size=options['workers'] + 1,
+            block=True,
+            http2=settings.TELEGRAM_HTTP2
+        )
+        path = options['offset_file']
+        tracker = OffsetTracker(read_offset(path))
+        saved = tracker.offset
+
+        def process(update, reply):
+            try:
+                process_update(update, reply)
+            finally:
+                tracker.done(update.update_id)
+
+        dispatcher = UpdateDispatcher(
+            process=process,
+            workers=options['workers'],
+            queue_size=options['queue_size']
+        )
+        signal.signal(signal.SIGTERM, raise_interrupt)
+        self.stdout.write(f'Получение обновлений, offset {tracker.offset}')
+
+        backoff = 1
+        try:
+            while True:
+                committed = tracker.committed
+                if committed != saved:
+                    write_offset(path, committed)
+                    saved = committed
+                try:
+                    updates = bot.get_updates(
+                        offset=tracker.offset,
+                        limit=options['limit'],
+                        timeout=apihelper.READ_TIMEOUT,
+                        allowed_updates=ALLOWED_UPDATES,
+                        long_polling_timeout=options['timeout']
+                    )
+                except ApiTelegramException as e:
+                    if e.error_code == 409:
+                        raise CommandError(
+                            'Установлен вебхук, удалите его командой: '
+                            'manage.py set_webhook --delete')
+                    logger.warning(f'getUpdates failed: {e}')
+                except (ApiException, RequestException) as e:
+                    logger.warning(
+                        f'getUpdates failed: {type(e).__name__}, '
+                        f'retry in {backoff}s')
+                else:
+                    backoff = 1
+                    for update in updates:
+                        if tracker.fetched(update.update_id):
+                            dispatcher.submit(update, block=True)
+                    continue
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+        except KeyboardInterrupt:
+            self.stdout.write('Остановка, обработка принятых обновлений')
+        finally:
+            dispatcher.stop()
+            write_offset(path, tracker.committed)
+            self.confirm(tracker.offset)
+            self.stdout.write(self.style.SUCCESS(
+                f'Остановлено, offset {tracker.committed}, '
+                f'обновления: {dispatcher.stats()}'
+            ))
+
+    @staticmethod
+    def confirm(offset):
+        """Подтверждение Telegram получения обновлений до offset
+
+        :param int offset: Первое неподтвержденное обновление
+        """
+        try:
+            bot.get_updates(
+                offset=offset,
+                limit=1,
+                timeout=apihelper.READ_TIMEOUT,
+                long_polling_timeout=1
+            )
+        except (ApiException, RequestException) as e:
+            logger.warning(f'Offset confirmation failed: {type(e).__name__}')
@@ -0,0 +1,65 @@
+"""set_webhook.py - Регистрация вебхука бота в Telegram
+
+Выполняется один раз при развертывании, а не при запуске каждого
+процесса: импорт представлений не обращается к Telegram API.
+"""
+from requests import RequestException
+from telebot.apihelper import ApiException
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tgbot.handlers import ALLOWED_UPDATES, bot
+
+
+class Command(BaseCommand):
+    help = 'Регистрация (или удаление) вебхука бота'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default=f'{settings.TELEGRAM_WEBHOOK_URL}/webhook/tgbot',
+            help='Адрес вебхука'
+        )
+        parser.add_argument(
+            '--max-connections',
+            type=int,
+            default=40,
+            help='Количество одновременных запросов от Telegram'
+        )
+        parser.add_argument(
+            '--drop-pending-updates',
+            action='store_true',
+            help='Удалить накопленные обновления'
+        )
+        parser.add_argument(
+            '--delete',
+            action='store_true',
+            help='Удалить вебхук (например, для manage.py runbot)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options['delete']:
+                bot.delete_webhook(
+                    drop_pending_updates=options['drop_pending_updates']
+                )
+                self.stdout.write(self.style.SUCCESS('Вебхук удален'))
+                return
+            bot.set_webhook(
+                url=options['url'],
+                max_connections=options['max_connections'],
+                allowed_updates=ALLOWED_UPDATES,
+                drop_pending_updates=options['drop_pending_updates']
+            )
+            info = bot.get_webhook_info()
+        except ApiException as e:
+            raise CommandError(f'Ошибка Telegram API: {e}')
+        except RequestException as e:
+            # Текст исключения содержит URL с токеном бота
+            raise CommandError(
+                f'Telegram API недоступен: {type(e).__name__}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Вебхук установлен: {info.url} '
+            f'(ожидает обработки: {info.pending_update_count})'
+        ))
@@ -0,0 +1,100 @@
+"""media.py - Отправка статических файлов бота по file_id
+
+Каждый файл из STATIC_ROOT загружается в Telegram один раз, полученный
+file_id сохраняется в БД (StaticMedia) и в памяти процесса. Повторная
+загрузка выполняется, только если Telegram не принял file_id.
+"""
+import logging
+import os
+
+from telebot.apihelper import ApiTelegramException
+
+from django.conf import settings
+
+from .models import StaticMedia
+
+logger = logging.getLogger(__name__)
+
+# Фрагменты описаний ошибок Telegram, при которых file_id недействителен
+FILE_ID_ERRORS = (
+    'file identifier',
+    'file_id',
+    'file reference',
+    'type of file mismatch',
+    "can't use file of type",
+)
+
+_file_ids = {}
+
+
+def is_file_id_rejected(error):
+    """Проверка, что Telegram отклонил именно file_id
+
+    Другие ошибки 400 (чат не найден, некорректная подпись и т.п.)
+    повторной загрузкой файла не исправляются.
+
+    :param ApiTelegramException error: Ошибка Telegram API
+    :rtype: bool
+    """
+    if error.error_code != 400:
+        return False
+    description = str(error.description).lower()
+    return any(fragment in description for fragment in FILE_ID_ERRORS)
+
+
+def get_message_file_id(message):
+    """Получение file_id файла из отправленного сообщения
+
+    :param Message message: Сообщение с файлом
+    :return: file_id (для фото - самого большого размера)
+    :rtype: str
+    """
+    content = getattr(message, message.content_type)
+    if isinstance(content, list):
+        content = content[-1]
+    return content.file_id
+
+
+def get_static_file_id(path):
+    """Получение сохраненного file_id статического файла
+
+    :param str path: Путь к файлу относительно STATIC_ROOT
+    :return: file_id или None, если файл еще не загружался
+    :rtype: str
+    """
+    if path not in _file_ids:
+        media = StaticMedia.objects.filter(path=path).first()
+        if media is None:
+            return None
+        _file_ids[path] = media.file_id
+    return _file_ids[path]
+
+
+def send_static_media(send, chat_id, path, **kwargs):
+    """Отправка статического файла
+
+    :param send: Метод бота для отправки (bot.send_sticker и т.д.)
+    :param int chat_id: Получатель сообщения
+    :param str path: Путь к файлу относительно STATIC_ROOT
+    :param kwargs: Дополнительные параметры метода отправки
+    :return: Отправленное сообщение
+    :rtype: Message
+    """
+    file_id = get_static_file_id(path)
+    if file_id is not None:
+        try:
+            return send(chat_id, file_id, **kwargs)
+        except ApiTelegramException as e:
+            if not is_file_id_rejected(e):
+                raise
+            logger.warning(f'file_id of {path} rejected, uploading again')
+
+    with open(os.path.join(settings.STATIC_ROOT, path), 'rb') as media:
+        message = send(chat_id, media.read(), **kwargs)
+    file_id = get_message_file_id(message)
+    StaticMedia.objects.update_or_create(
+        path=path,
+        defaults={'file_id': file_id}
+    )
+    _file_ids[path] = file_id
+    return message
@@ -0,0 +1,20 @@
+# Generated by Django 4.0 on 2026-10-18 12:00
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot', '0021_alter_profilesearch_unviewed_and_more'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='city',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='city_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.0 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+from tgbot.utils import normalize_city_name, transliterate
+
+
+def fill_normalized_names(apps, schema_editor):
+    City = apps.get_model('tgbot', 'City')
+    cities = list(City.objects.only('pk', 'name'))
+    for city in cities:
+        city.name_normalized = normalize_city_name(city.name)
+        city.name_latin = transliterate(city.name_normalized)
+    City.objects.bulk_update(
+        cities, ['name_normalized', 'name_latin'], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot', '0022_city_name_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='name_latin',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=400, verbose_name='Наименование латиницей'),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='name_normalized',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=200, verbose_name='Нормализованное наименование'),
+        ),
+        migrations.RunPython(fill_normalized_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot', '0023_city_name_normalized'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['city', 'sex', 'age'], include=('user',), name='profile_search_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot', '0024_profile_search_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='profile',
+            name='profile_search_idx',
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_registered', True)), fields=['city', 'sex', 'age'], include=('user',), name='profile_search_idx'),
+        ),
+    ]
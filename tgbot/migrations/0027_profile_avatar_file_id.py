@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot', '0026_profile_search_idx_partial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_file_id',
+            field=models.CharField(blank=True, max_length=200, verbose_name='file_id фото в Telegram'),
+        ),
+    ]
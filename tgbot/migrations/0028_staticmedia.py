@@ -0,0 +1,25 @@
+# Generated by Django 4.0 on 2026-10-18 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot', '0027_profile_avatar_file_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaticMedia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=200, unique=True, verbose_name='Путь к файлу в STATIC_ROOT')),
+                ('file_id', models.CharField(max_length=200, verbose_name='file_id в Telegram')),
+            ],
+            options={
+                'verbose_name': 'Статический файл',
+                'verbose_name_plural': 'Статические файлы',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot', '0028_staticmedia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationStep',
+            fields=[
+                ('chat_id', models.IntegerField(primary_key=True, serialize=False, verbose_name='Chat id пользователя')),
+                ('step', models.CharField(max_length=50, verbose_name='Шаг диалога')),
+                ('args', models.JSONField(blank=True, default=list, verbose_name='Аргументы шага')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Шаг диалога',
+                'verbose_name_plural': 'Шаги диалога',
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.0 on 2026-10-18 10:29
+
+from django.db import migrations, models
+import tgbot.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot', '0029_conversationstep'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='profile',
+            name='profile_search_idx',
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='search_key',
+            field=models.FloatField(default=tgbot.models.get_search_key, editable=False, verbose_name='Позиция в поиске'),
+        ),
+        # Значение по умолчанию вычисляется один раз для всех строк
+        migrations.RunSQL(
+            'UPDATE tgbot_profile SET search_key = random()',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddField(
+            model_name='profilesearch',
+            name='search_cursor',
+            field=models.FloatField(blank=True, null=True, verbose_name='Курсор обхода анкет'),
+        ),
+        migrations.AddField(
+            model_name='profilesearch',
+            name='search_start',
+            field=models.FloatField(blank=True, null=True, verbose_name='Начало обхода анкет'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_registered', True)), fields=['city', 'sex', 'search_key'], include=('user', 'age'), name='profile_search_idx'),
+        ),
+    ]
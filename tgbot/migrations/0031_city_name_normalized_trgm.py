@@ -0,0 +1,22 @@
+# Generated by Django 4.0 on 2026-10-18 10:55
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tgbot', '0030_search_cursor'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='city',
+            name='city_name_trgm',
+        ),
+        migrations.AddIndex(
+            model_name='city',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name_normalized'], name='city_name_normalized_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -1,5 +1,8 @@
+import random
+
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.db import models, transaction
 
 
 class User(models.Model):
@@ -35,16 +38,124 @@ class City(models.Model):
         blank=True,
         verbose_name='Регион'
     )
+    name_normalized = models.CharField(
+        max_length=200,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name='Нормализованное наименование'
+    )
+    name_latin = models.CharField(
+        max_length=400,
+        blank=True,
+        db_index=True,
+        editable=False,
+        verbose_name='Наименование латиницей'
+    )
 
     class Meta:
         verbose_name = 'Город'
         verbose_name_plural = 'Города'
+        indexes = [
+            GinIndex(
+                name='city_name_normalized_trgm',
+                fields=['name_normalized'],
+                opclasses=['gin_trgm_ops']
+            ),
+        ]
 
     def __str__(self):
         return str(f'{self.name}, {self.region}')
 
 
-class Profile(models.Model):
+def get_search_key():
+    """Случайная позиция анкеты в порядке обхода при поиске"""
+    return random.random()
+
+
+class TrackedModel(models.Model):
+    """Модель с отслеживанием измененных полей
+
+    При загрузке из БД запоминаются значения полей. save() без
+    update_fields записывает только измененные поля, а если изменений
+    нет - не выполняет запрос.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.take_snapshot()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self.take_snapshot(fields)
+
+    def take_snapshot(self, fields=None):
+        """Запоминание текущих значений загруженных полей
+
+        :param fields: Наименования полей (None - все поля)
+        """
+        if not hasattr(self, '_snapshot'):
+            self._snapshot = {}
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if (fields is not None and field.name not in fields
+                    and field.attname not in fields):
+                continue
+            value = getattr(self, field.attname)
+            if isinstance(value, list):
+                value = list(value)
+            self._snapshot[field.attname] = value
+
+    def get_dirty_fields(self):
+        """Поля, измененные после загрузки или сохранения
+
+        :return: Наименования полей
+        :rtype: list
+        """
+        snapshot = getattr(self, '_snapshot', {})
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (field.attname not in snapshot
+                 or snapshot[field.attname] != getattr(self, field.attname))
+        ]
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            dirty = self.get_dirty_fields()
+            if not dirty:
+                return
+            kwargs['update_fields'] = dirty
+        super().save(*args, **kwargs)
+        self.take_snapshot(kwargs.get('update_fields'))
+
+
+def save_changes(*instances):
+    """Сохранение измененных полей нескольких моделей
+
+    Если изменения есть в нескольких моделях, они записываются
+    в одной транзакции.
+
+    :param instances: Объекты TrackedModel
+    """
+    dirty = [instance for instance in instances if instance.get_dirty_fields()]
+    if len(dirty) > 1:
+        with transaction.atomic():
+            for instance in dirty:
+                instance.save()
+    elif dirty:
+        dirty[0].save()
+
+
+class Profile(TrackedModel):
     user = models.OneToOneField(
         User,
         on_delete=models.CASCADE,
@@ -84,16 +195,34 @@ class Profile(models.Model):
         default=True,
         verbose_name='Анкета активна?'
     )
+    avatar_file_id = models.CharField(
+        max_length=200,
+        blank=True,
+        verbose_name='file_id фото в Telegram'
+    )
+    search_key = models.FloatField(
+        default=get_search_key,
+        editable=False,
+        verbose_name='Позиция в поиске'
+    )
 
     class Meta:
         verbose_name = 'Профиль'
         verbose_name_plural = 'Профили'
+        indexes = [
+            models.Index(
+                name='profile_search_idx',
+                fields=['city', 'sex', 'search_key'],
+                include=['user', 'age'],
+                condition=models.Q(is_active=True, is_registered=True)
+            ),
+        ]
 
     def __str__(self):
         return str(self.user)
 
 
-class ProfileSearch(models.Model):
+class ProfileSearch(TrackedModel):
     user = models.OneToOneField(
         User,
         on_delete=models.CASCADE,
@@ -125,6 +254,16 @@ class ProfileSearch(models.Model):
         default=list,
         blank=True
     )
+    search_start = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name='Начало обхода анкет'
+    )
+    search_cursor = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name='Курсор обхода анкет'
+    )
 
     class Meta:
         verbose_name = 'Профиль для поиска'
@@ -132,3 +271,54 @@ class ProfileSearch(models.Model):
 
     def __str__(self):
         return str(self.user)
+
+    def reset_queue(self):
+        """Сброс очереди поиска (после изменения настроек поиска)"""
+        self.unviewed = []
+        self.search_cursor = None
+
+
+class StaticMedia(models.Model):
+    path = models.CharField(
+        max_length=200,
+        unique=True,
+        verbose_name='Путь к файлу в STATIC_ROOT'
+    )
+    file_id = models.CharField(
+        max_length=200,
+        verbose_name='file_id в Telegram'
+    )
+
+    class Meta:
+        verbose_name = 'Статический файл'
+        verbose_name_plural = 'Статические файлы'
+
+    def __str__(self):
+        return str(self.path)
+
+
+class ConversationStep(models.Model):
+    chat_id = models.IntegerField(
+        primary_key=True,
+        verbose_name='Chat id пользователя'
+    )
+    step = models.CharField(
+        max_length=50,
+        verbose_name='Шаг диалога'
+    )
+    args = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='Аргументы шага'
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+
+    class Meta:
+        verbose_name = 'Шаг диалога'
+        verbose_name_plural = 'Шаги диалога'
+
+    def __str__(self):
+        return f'{self.chat_id}: {self.step}'
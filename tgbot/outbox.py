@@ -0,0 +1,196 @@
+"""outbox.py - Объединение исходящих вызовов Telegram при обработке обновления
+
+Подряд идущие правки одного сообщения (текст и клавиатура)
+накапливаются и отправляются одним вызовом editMessageText или
+editMessageReplyMarkup: перед любым другим вызовом Telegram API
+(Outbox.request) и после обработки обновления. Поэтому пользователь
+видит сообщения в том порядке, в котором их отправил обработчик.
+
+Ответ на callback передается представлению сразу при вызове
+answer_callback_query и возвращается в теле ответа на вебхук, если
+представление еще ждет его (WebhookReply). Иначе ответ отправляется
+обычным вызовом answerCallbackQuery.
+"""
+import threading
+
+
+class WebhookReply:
+    """Вызов Telegram API, возвращаемый в ответе на вебхук
+
+    Поток-обработчик предлагает вызов (offer), представление ждет его
+    (wait). После ожидания слот закрывается, и поздний вызов
+    отправляется обработчиком самостоятельно.
+    """
+
+    def __init__(self):
+        self.payload = None
+        self._closed = False
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    def offer(self, payload):
+        """Передача вызова представлению
+
+        :param payload: Вызов ({'method': ..., параметры}) или None,
+            если вызова не будет
+        :return: Принят ли вызов (False - представление уже ответило)
+        :rtype: bool
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            self.payload = payload
+            self._closed = True
+        self._event.set()
+        return True
+
+    def wait(self, timeout):
+        """Ожидание вызова от обработчика
+
+        :param float timeout: Время ожидания в секундах
+        :return: Вызов или None
+        :rtype: dict
+        """
+        self._event.wait(timeout)
+        with self._lock:
+            self._closed = True
+            return self.payload
+
+
+class PendingCalls:
+    """Вызовы, накопленные при обработке одного обновления
+
+    :param WebhookReply reply: Слот ответа на вебхук (если есть)
+    """
+
+    def __init__(self, reply=None):
+        self.reply = reply
+        self.edits = {}
+
+
+class Outbox:
+    """Слой исходящих вызовов бота
+
+    Вне process_update вызовы выполняются сразу.
+
+    :param TeleBot bot: Бот, через который отправляются вызовы
+    :param sender: Функция выполнения запроса к Telegram API
+        (с сигнатурой apihelper.CUSTOM_REQUEST_SENDER)
+    """
+
+    def __init__(self, bot, sender):
+        self.bot = bot
+        self.sender = sender
+        self._local = threading.local()
+
+    @property
+    def pending(self):
+        return getattr(self._local, 'pending', None)
+
+    def process_update(self, update, reply=None):
+        """Обработка обновления с отправкой накопленных вызовов
+
+        :param Update update: Обновление от Telegram
+        :param WebhookReply reply: Слот ответа на вебхук
+        """
+        self._local.pending = PendingCalls(reply)
+        try:
+            self.bot.process_new_updates([update])
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            self.flush(pending)
+
+    def request(self, method, url, **kwargs):
+        """Выполнение запроса к Telegram API
+
+        Подключается как apihelper.CUSTOM_REQUEST_SENDER. Накопленные
+        правки отправляются перед запросом, чтобы не обогнать его.
+
+        :return: Ответ сервера
+        :rtype: requests.Response
+        """
+        pending = self.pending
+        if pending is not None and pending.edits:
+            self.send_edits(pending)
+        return self.sender(method, url, **kwargs)
+
+    def edit_message(self, chat_id, message_id, **fields):
+        """Изменение текста и/или клавиатуры сообщения
+
+        Повторные правки одного сообщения объединяются, поздние
+        значения полей заменяют ранние. Правка без text убирает
+        или заменяет только клавиатуру.
+
+        :param chat_id: Чат сообщения
+        :param message_id: Id сообщения
+        :param fields: text, parse_mode, reply_markup
+        """
+        if self.pending is None:
+            self.send_edit(chat_id, message_id, fields)
+            return
+        edits = self.pending.edits
+        edits.setdefault((chat_id, message_id), {}).update(fields)
+
+    def answer_callback_query(self, callback_query_id, text=None,
+                              show_alert=None):
+        """Ответ на callback (один на обновление)
+
+        Ответ сразу передается ожидающему представлению, чтобы клиент
+        Telegram убрал индикатор загрузки с клавиши, не дожидаясь
+        окончания обработки.
+
+        :param callback_query_id: Id callback
+        :param str text: Уведомление пользователю
+        :param bool show_alert: Показать уведомление окном
+        """
+        answer = {
+            'callback_query_id': callback_query_id,
+            'text': text,
+            'show_alert': show_alert,
+        }
+        reply = self.pending.reply if self.pending is not None else None
+        if reply is not None:
+            payload = {
+                'method': 'answerCallbackQuery',
+                **{key: value for key, value in answer.items()
+                   if value is not None},
+            }
+            if reply.offer(payload):
+                return
+        self.bot.answer_callback_query(**answer)
+
+    def send_edit(self, chat_id, message_id, fields):
+        """Отправка правки сообщения одним вызовом"""
+        if 'text' in fields:
+            self.bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id, **fields
+            )
+        else:
+            self.bot.edit_message_reply_markup(
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=fields.get('reply_markup')
+            )
+
+    def send_edits(self, pending):
+        """Отправка накопленных правок сообщений
+
+        :param PendingCalls pending: Накопленные вызовы
+        """
+        edits, pending.edits = pending.edits, {}
+        for (chat_id, message_id), fields in edits.items():
+            self.send_edit(chat_id, message_id, fields)
+
+    def flush(self, pending):
+        """Отправка вызовов, оставшихся после обработки обновления
+
+        Представление, ожидающее ответ на callback, освобождается,
+        даже если ответа не было.
+
+        :param PendingCalls pending: Накопленные вызовы
+        """
+        try:
+            self.send_edits(pending)
+        finally:
+            if pending.reply is not None:
+                pending.reply.offer(None)
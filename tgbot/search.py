@@ -0,0 +1,216 @@
+"""search.py - Подбор анкет для поиска собеседника
+
+Просмотренные анкеты (ProfileSearch.viewed) хранятся как массив
+в порядке просмотра, а исключение просмотренных анкет из выдачи
+выполняется в БД одним запросом.
+
+Очередь анкет (ProfileSearch.unviewed) и массив просмотренных анкет
+не загружаются в Python: очередная анкета извлекается из очереди
+и отмечается просмотренной одним запросом UPDATE на стороне БД.
+
+Очередь заполняется небольшими страницами (SEARCH_PAGE_SIZE) по мере
+опустошения, позиция обхода хранится в курсоре ProfileSearch.search_cursor.
+"""
+import random
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Func, IntegerField
+
+from .models import Profile, ProfileSearch
+
+
+def get_searchable_profiles():
+    """Анкеты, доступные для поиска (активные и зарегистрированные)
+
+    Условие совпадает с условием частичного индекса profile_search_idx.
+
+    :rtype: QuerySet
+    """
+    return Profile.objects.filter(is_active=True, is_registered=True)
+
+
+def get_search_candidates(client):
+    """Непросмотренные анкеты, подходящие под настройки поиска
+
+    Просмотренные анкеты исключаются подзапросом unnest(viewed),
+    поэтому массив не передается из Python в БД.
+
+    :param User client: Текущий пользователь бота
+    :rtype: QuerySet
+    """
+    start_age, end_age = map(int, client.profilesearch.age.split('-'))
+    viewed = ProfileSearch.objects.filter(user_id=client.chat_id).annotate(
+        viewed_id=Func('viewed', function='unnest',
+                       output_field=IntegerField())
+    ).values('viewed_id')
+    return get_searchable_profiles().filter(
+        age__range=(start_age, end_age),
+        sex=client.profilesearch.sex,
+        city_id=client.profilesearch.city_id
+    ).exclude(
+        user_id=client.chat_id
+    ).exclude(
+        user_id__in=viewed
+    )
+
+
+def get_search_page(client, limit):
+    """Следующая страница анкет в порядке обхода
+
+    Анкеты обходятся по возрастанию Profile.search_key, начиная со
+    случайной точки search_start, с переходом от 1 к 0 (по кругу).
+    Курсор search_cursor хранит последнюю пройденную позицию:
+    значение не меньше search_start - первый участок (start, 1],
+    меньше search_start - второй участок (cursor, start),
+    отрицательное - обход закончен. Каждая страница выбирается по
+    индексу profile_search_idx (city, sex, search_key) без сортировки
+    всех подходящих анкет.
+
+    :param User client: Текущий пользователь бота
+    :param int limit: Количество анкет на странице
+    :return: chat_id анкет в порядке обхода
+    :rtype: list
+    """
+    search = client.profilesearch
+    if search.search_cursor is None:
+        search.search_start = random.random()
+        search.search_cursor = search.search_start
+    start = search.search_start
+    candidates = []
+    queryset = get_search_candidates(client).order_by('search_key')
+    while len(candidates) < limit and search.search_cursor >= 0:
+        wrapped = search.search_cursor < start
+        keys = {'search_key__gt': search.search_cursor}
+        if wrapped:
+            keys['search_key__lt'] = start
+        need = limit - len(candidates)
+        page = list(queryset.filter(
+            **keys
+        ).values_list('user_id', 'search_key')[:need])
+        candidates.extend(user_id for user_id, _ in page)
+        if len(page) < need:
+            search.search_cursor = -1 if wrapped else 0
+        else:
+            search.search_cursor = page[-1][1]
+    return candidates
+
+
+POP_CANDIDATE_SQL = """
+WITH head AS (
+    SELECT user_id,
+        unviewed[cardinality(unviewed)] AS candidate,
+        unviewed[cardinality(unviewed)] = ANY(viewed) AS seen
+    FROM {search_table}
+    WHERE user_id = %s AND cardinality(unviewed) > 0
+    FOR UPDATE
+)
+UPDATE {search_table} AS ps
+SET unviewed = ps.unviewed[1:cardinality(ps.unviewed) - 1],
+    viewed = CASE
+        WHEN head.seen OR NOT EXISTS (
+            SELECT 1 FROM {profile_table} AS p
+            WHERE p.user_id = head.candidate
+                AND p.is_active AND p.is_registered
+        ) THEN ps.viewed
+        ELSE array_append(ps.viewed, head.candidate)
+    END
+FROM head
+WHERE ps.user_id = head.user_id
+RETURNING head.candidate, head.seen
+"""
+
+
+def pop_search_candidate(user_id):
+    """Извлечение очередной анкеты из очереди поиска
+
+    Анкета удаляется из конца очереди и, если она доступна для поиска,
+    добавляется в конец просмотренных. Все выполняется одним запросом
+    под блокировкой строки. Анкета, которая уже была в просмотренных
+    (например, ее показал параллельный запрос), помечается признаком seen
+    и не должна показываться повторно.
+
+    :param int user_id: chat_id текущего пользователя
+    :return: chat_id анкеты и признак seen или None, если очередь пуста
+    :rtype: tuple
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            POP_CANDIDATE_SQL.format(
+                search_table=ProfileSearch._meta.db_table,
+                profile_table=Profile._meta.db_table
+            ),
+            [user_id]
+        )
+        row = cursor.fetchone()
+    return tuple(row) if row else None
+
+
+def refill_search_queue(client):
+    """Заполнение очереди поиска следующей страницей анкет
+
+    Строка ProfileSearch блокируется (select_for_update), и курсор
+    читается уже под блокировкой. Параллельное заполнение (второе
+    нажатие, другой процесс) ждет окончания первого и, найдя очередь
+    заполненной, не перезаписывает ее и не сдвигает курсор назад.
+
+    Если прежний обход закончен и не дал анкет, в том же заполнении
+    начинается новый обход (уже просмотренные анкеты в него не попадут),
+    поэтому пользователь не получает ответ "никого не нашли", пока
+    подходящие анкеты есть. Пустой новый обход сбрасывает курсор.
+
+    :param User client: Текущий пользователь бота
+    :return: Количество анкет в очереди
+    :rtype: int
+    """
+    search = client.profilesearch
+    with transaction.atomic():
+        locked = ProfileSearch.objects.select_for_update().annotate(
+            queued=Func('unviewed', function='cardinality',
+                        output_field=IntegerField())
+        ).values(
+            'queued', 'search_start', 'search_cursor'
+        ).get(user_id=client.chat_id)
+        if locked['queued']:
+            return locked['queued']
+        search.search_start = locked['search_start']
+        search.search_cursor = locked['search_cursor']
+        candidates = get_search_page(client, settings.SEARCH_PAGE_SIZE)
+        if not candidates and locked['search_cursor'] is not None:
+            search.search_cursor = None
+            candidates = get_search_page(client, settings.SEARCH_PAGE_SIZE)
+        if not candidates:
+            search.search_cursor = None
+        # Анкеты извлекаются из конца очереди
+        search.unviewed = candidates[::-1]
+        search.save(
+            update_fields=['unviewed', 'search_start', 'search_cursor']
+        )
+    return len(candidates)
+
+
+def find_next_search_profile(client):
+    """Получение очередной анкеты для показа
+
+    Анкеты, ставшие недоступными или уже просмотренными после попадания
+    в очередь, пропускаются.
+    Пустая очередь заполняется следующей страницей анкет.
+
+    :param User client: Текущий пользователь бота
+    :return: Анкета (вместе с пользователем) или None, если никого не нашли
+    :rtype: Profile
+    """
+    while True:
+        item = pop_search_candidate(client.chat_id)
+        if item is None:
+            if not refill_search_queue(client):
+                return None
+            continue
+        user_id, seen = item
+        if seen:
+            continue
+        profile = get_searchable_profiles().select_related(
+            'user'
+        ).filter(user_id=user_id).first()
+        if profile is not None:
+            return profile
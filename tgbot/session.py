@@ -0,0 +1,114 @@
+"""session.py - Общая HTTP-сессия для запросов к Telegram API
+
+Все потоки бота используют одну сессию с пулом keep-alive соединений,
+поэтому TCP и TLS соединение устанавливается один раз на соединение пула,
+а не на каждый запрос. Размер пула не меньше количества потоков,
+одновременно обращающихся к Telegram (обработчиков обновлений или,
+при обработке внутри запроса вебхука, потоков веб-сервера).
+HTTP/2 включается настройкой TELEGRAM_HTTP2 и требует пакета httpx[http2].
+"""
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+class Http2Session:
+    """Сессия HTTP/2 с интерфейсом requests.Session
+
+    Поддерживает вызовы, которые делает apihelper: request() и get().
+    Все запросы мультиплексируются в небольшом количестве соединений.
+
+    :param int pool_size: Максимальное количество соединений
+    """
+
+    def __init__(self, pool_size):
+        try:
+            import httpx
+        except ImportError:
+            raise ImproperlyConfigured(
+                'TELEGRAM_HTTP2 requires the httpx[http2] package')
+        self.httpx = httpx
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size
+            )
+        )
+
+    def request(self, method, url, params=None, files=None, timeout=None,
+                proxies=None, **kwargs):
+        """Выполнение запроса
+
+        Ошибки httpx преобразуются в исключения requests, которые
+        перехватывают вызывающие. Текст исходной ошибки не сохраняется,
+        так как URL запроса содержит токен бота.
+
+        :param tuple timeout: (connect, read) как в requests
+        :param dict proxies: apihelper.proxy (не поддерживается)
+        :return: Ответ с полями status_code, text, content и методом json()
+        :rtype: httpx.Response
+        :raises ImproperlyConfigured: Если задан прокси
+        :raises requests.RequestException: При ошибке запроса
+        """
+        if proxies:
+            raise ImproperlyConfigured(
+                'TELEGRAM_HTTP2 does not support apihelper.proxy')
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = self.httpx.Timeout(read, connect=connect)
+        try:
+            return self.client.request(
+                method.upper(), url, params=params, files=files,
+                timeout=timeout
+            )
+        except self.httpx.HTTPError as e:
+            raise self.convert_error(e) from None
+
+    def convert_error(self, error):
+        """Исключение requests, соответствующее ошибке httpx
+
+        :param httpx.HTTPError error: Ошибка httpx
+        :rtype: requests.RequestException
+        """
+        httpx = self.httpx
+        message = type(error).__name__
+        if isinstance(error, httpx.ConnectTimeout):
+            return requests.ConnectTimeout(message)
+        if isinstance(error, httpx.ReadTimeout):
+            return requests.ReadTimeout(message)
+        if isinstance(error, httpx.TimeoutException):
+            return requests.Timeout(message)
+        if isinstance(error, httpx.NetworkError):
+            return requests.ConnectionError(message)
+        return requests.RequestException(message)
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def close(self):
+        self.client.close()
+
+
+def create_session(pool_size, block=False, http2=False):
+    """Создание потокобезопасной сессии с пулом соединений
+
+    :param int pool_size: Количество соединений в пуле
+    :param bool block: При исчерпании пула ждать освободившееся соединение
+        (иначе открывается дополнительное соединение вне пула). Подходит,
+        только если количество потоков известно и не больше pool_size
+    :param bool http2: Использовать HTTP/2
+    :rtype: requests.Session or Http2Session
+    """
+    if http2:
+        return Http2Session(pool_size)
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        pool_block=block
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
@@ -0,0 +1,25 @@
+"""signals.py - Обработчики сигналов моделей
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cities import invalidate_city_search
+from .models import City
+from .utils import normalize_city_name, transliterate
+
+
+@receiver(pre_save, sender=City)
+def fill_city_normalized_name(sender, instance, **kwargs):
+    """Заполнение нормализованного наименования города перед сохранением
+
+    Срабатывает в том числе при loaddata (raw=True).
+    """
+    instance.name_normalized = normalize_city_name(instance.name)
+    instance.name_latin = transliterate(instance.name_normalized)
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def reset_city_search(sender, **kwargs):
+    """Сброс кэша поиска городов при изменении таблицы городов"""
+    invalidate_city_search()
@@ -0,0 +1,225 @@
+"""steps.py - Хранение шагов цепочек диалога вне процесса
+
+Следующий шаг диалога (регистрация, изменение профиля, сообщение
+об ошибке) хранится как (chat_id, step, args): наименование шага и
+аргументы, сериализуемые в JSON. Поэтому ответ пользователя может
+обработать любой процесс бота.
+
+Хранилище задается настройкой TELEGRAM_STEP_STORAGE:
+- database - таблица tgbot_conversationstep;
+- cache - кэш Django TELEGRAM_STEP_CACHE (Redis или локальный кэш
+  процесса для разработки).
+
+На один чат хранится один шаг: новый шаг заменяет прежний. Шаг
+забирается атомарно, поэтому ответ пользователя обрабатывает только
+один процесс.
+
+Шаг действует TELEGRAM_STEP_TTL секунд. В кэше устаревший шаг удаляет
+сам кэш, в БД он игнорируется, а строки устаревших шагов удаляются
+командой manage.py purge_steps.
+"""
+import json
+import uuid
+from datetime import timedelta
+
+from telebot import Handler
+from telebot.handler_backends import HandlerBackend
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+from .models import ConversationStep
+from .users import get_step_expiry, may_have_step
+
+
+class DatabaseStepStorage:
+    """Шаги диалога в таблице БД
+
+    :param int ttl: Время действия шага в секундах
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def set(self, chat_id, step, args=()):
+        """Сохранение шага одним запросом (INSERT ... ON CONFLICT)
+
+        :param int chat_id: Chat id пользователя
+        :param str step: Наименование шага
+        :param args: Аргументы шага (сериализуемые в JSON)
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {ConversationStep._meta.db_table} '
+                f'(chat_id, step, args, updated) '
+                f'VALUES (%s, %s, %s, now()) '
+                f'ON CONFLICT (chat_id) DO UPDATE SET step = EXCLUDED.step, '
+                f'args = EXCLUDED.args, updated = EXCLUDED.updated',
+                [chat_id, step, json.dumps(list(args))]
+            )
+
+    def pop(self, chat_id):
+        """Получение и удаление шага одним запросом
+
+        Запрос не выполняется, если при загрузке пользователя
+        выяснилось, что шага нет (may_have_step). Устаревший шаг
+        удаляется тем же запросом, но не возвращается.
+
+        :param int chat_id: Chat id пользователя
+        :return: Наименование и аргументы шага или None
+        :rtype: tuple
+        """
+        if not may_have_step(chat_id):
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {ConversationStep._meta.db_table} '
+                f'WHERE chat_id = %s '
+                f'RETURNING step, args, updated > now() - %s',
+                [chat_id, timedelta(seconds=self.ttl)]
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        step, args, live = row
+        if not live:
+            return None
+        if isinstance(args, str):
+            args = json.loads(args)
+        return step, args
+
+    def clear(self, chat_id):
+        """Удаление шага
+
+        :param int chat_id: Chat id пользователя
+        """
+        ConversationStep.objects.filter(chat_id=chat_id).delete()
+
+    @staticmethod
+    def purge():
+        """Удаление устаревших шагов
+
+        :return: Количество удаленных шагов
+        :rtype: int
+        """
+        deleted, _ = ConversationStep.objects.filter(
+            updated__lte=get_step_expiry()
+        ).delete()
+        return deleted
+
+
+class CacheStepStorage:
+    """Шаги диалога в кэше Django
+
+    Шаг хранится под ключом с версией, ключ чата указывает на текущую
+    версию. Шаг получает только тот процесс, чей cache.delete удалил
+    запись версии, поэтому один шаг не обрабатывается дважды.
+
+    :param str alias: Кэш из CACHES
+    :param int ttl: Время хранения шага в секундах
+    """
+
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def get_key(chat_id):
+        return f'tgbot:step:{chat_id}'
+
+    @staticmethod
+    def get_version_key(chat_id, version):
+        return f'tgbot:step:{chat_id}:{version}'
+
+    def set(self, chat_id, step, args=()):
+        version = uuid.uuid4().hex
+        self.cache.set(
+            self.get_version_key(chat_id, version), (step, list(args)),
+            self.ttl
+        )
+        self.cache.set(self.get_key(chat_id), version, self.ttl)
+
+    def pop(self, chat_id):
+        version = self.cache.get(self.get_key(chat_id))
+        if version is None:
+            return None
+        key = self.get_version_key(chat_id, version)
+        item = self.cache.get(key)
+        if item is None or not self.cache.delete(key):
+            return None
+        return item
+
+    def clear(self, chat_id):
+        self.cache.delete(self.get_key(chat_id))
+
+    @staticmethod
+    def purge():
+        """Устаревшие шаги удаляет кэш"""
+        return 0
+
+
+class StepHandlerBackend(HandlerBackend):
+    """Хранилище next step handlers для TeleBot
+
+    Обработчик шага сохраняется по наименованию, зарегистрированному
+    декоратором step, и восстанавливается по нему же. Шаг с неизвестным
+    наименованием (например, сохраненный прежней версией бота) пропускается.
+
+    :param storage: Хранилище шагов
+    """
+
+    def __init__(self, storage):
+        super().__init__()
+        self.storage = storage
+        self.steps = {}
+        self.names = {}
+
+    def step(self, name):
+        """Декоратор регистрации функции шага
+
+        :param str name: Наименование шага
+        """
+        def decorator(func):
+            self.steps[name] = func
+            self.names[func] = name
+            return func
+
+        return decorator
+
+    def register_handler(self, handler_group_id, handler):
+        self.storage.set(
+            handler_group_id, self.names[handler.callback], handler.args
+        )
+
+    def clear_handlers(self, handler_group_id):
+        self.storage.clear(handler_group_id)
+
+    def get_handlers(self, handler_group_id):
+        item = self.storage.pop(handler_group_id)
+        if item is None:
+            return None
+        step, args = item
+        if step not in self.steps:
+            return None
+        return [Handler(self.steps[step], *args)]
+
+
+def create_step_storage():
+    """Создание хранилища шагов по настройке TELEGRAM_STEP_STORAGE
+
+    :rtype: DatabaseStepStorage or CacheStepStorage
+    """
+    if settings.TELEGRAM_STEP_STORAGE == 'cache':
+        return CacheStepStorage(
+            alias=settings.TELEGRAM_STEP_CACHE,
+            ttl=settings.TELEGRAM_STEP_TTL
+        )
+    return DatabaseStepStorage(ttl=settings.TELEGRAM_STEP_TTL)
+
+
+step_storage = create_step_storage()
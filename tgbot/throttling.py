@@ -0,0 +1,173 @@
+"""throttling.py - Ограничение частоты исходящих запросов к Telegram
+
+Каждый запрос проходит через общий token bucket (лимит бота).
+Отправка сообщений в чат (методы send*, forwardMessage, copyMessage)
+дополнительно проходит через token bucket своего чата: правки сообщений,
+ответы на callback и другие вызовы без нового сообщения в чате лимитом
+чата не ограничены и не задерживают поток обработчика.
+
+Ответ 429 повторяется после паузы retry_after со случайной добавкой,
+чтобы потоки не повторяли запросы одновременно. Подключается как
+apihelper.CUSTOM_REQUEST_SENDER.
+"""
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from telebot import apihelper
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Методы, отправляющие новое сообщение, кроме send*
+CHAT_SEND_METHODS = ('forwardMessage', 'copyMessage')
+
+
+def is_chat_send(method_name):
+    """Проверка, что метод отправляет в чат новое сообщение
+
+    :param str method_name: Метод Telegram API (sendMessage и т.д.)
+    :rtype: bool
+    """
+    return method_name.startswith('send') or method_name in CHAT_SEND_METHODS
+
+
+class TokenBucket:
+    """Token bucket с резервированием
+
+    Если токенов нет, токен все равно списывается (баланс уходит
+    в минус), а вызывающий получает время ожидания своей очереди.
+
+    :param float rate: Токенов в секунду
+    :param int capacity: Максимальный запас токенов
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """Резервирование одного токена (вызывается под блокировкой)
+
+        :return: Время ожидания в секундах
+        :rtype: float
+        """
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """Планировщик исходящих запросов к Telegram API
+
+    :param float global_rate: Запросов в секунду на весь бот
+    :param float chat_rate: Запросов в секунду в один чат
+    :param int chat_burst: Запросов в один чат без ожидания
+    :param int max_retries: Повторов после ответа 429
+    :param int chats: Количество хранимых token bucket чатов
+    """
+
+    def __init__(self, global_rate, chat_rate, chat_burst, max_retries,
+                 chats=10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.chats = chats
+        self.chat_buckets = OrderedDict()
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.retries = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, chat_id=None):
+        """Ожидание разрешения на запрос
+
+        :param chat_id: Чат, в который отправляется сообщение
+            (None - запрос учитывается только в лимите бота)
+        """
+        with self._lock:
+            delay = self.global_bucket.reserve()
+            if chat_id is not None:
+                bucket = self.chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                    self.chat_buckets[chat_id] = bucket
+                    if len(self.chat_buckets) > self.chats:
+                        self.chat_buckets.popitem(last=False)
+                else:
+                    self.chat_buckets.move_to_end(chat_id)
+                delay = max(delay, bucket.reserve())
+            if delay:
+                self.throttled += 1
+                self.throttled_seconds += delay
+        if delay:
+            time.sleep(delay)
+
+    def request(self, method, url, params=None, files=None, **kwargs):
+        """Выполнение запроса к Telegram API с учетом лимитов
+
+        Сигнатура совпадает с apihelper.CUSTOM_REQUEST_SENDER.
+
+        :return: Ответ сервера (после исчерпания повторов - последний 429)
+        :rtype: requests.Response
+        """
+        chat_id = (params or {}).get('chat_id')
+        method_name = url.rsplit('/', 1)[-1]
+        if not is_chat_send(method_name):
+            chat_id = None
+        for attempt in range(self.max_retries + 1):
+            self.acquire(chat_id)
+            response = apihelper._get_req_session().request(
+                method, url, params=params, files=files, **kwargs
+            )
+            if response.status_code != 429:
+                return response
+            try:
+                parameters = response.json().get('parameters') or {}
+            except ValueError:
+                parameters = {}
+            retry_after = parameters.get('retry_after', 1)
+            with self._lock:
+                if attempt == self.max_retries:
+                    self.rejected += 1
+                    break
+                self.retries += 1
+            logger.warning(
+                f'Telegram 429 for {method_name}, retry in {retry_after}s')
+            time.sleep(retry_after + random.uniform(0, retry_after / 2 + 1))
+        return response
+
+    def stats(self):
+        """Счетчики ограничения запросов
+
+        :return: Количество и суммарное время ожиданий, повторов после 429
+            и запросов, для которых повторы исчерпаны
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'throttled': self.throttled,
+                'throttled_seconds': round(self.throttled_seconds, 3),
+                'retries': self.retries,
+                'rejected': self.rejected,
+            }
+
+
+rate_limiter = RateLimiter(
+    global_rate=settings.TELEGRAM_RATE_LIMIT,
+    chat_rate=settings.TELEGRAM_CHAT_RATE_LIMIT,
+    chat_burst=settings.TELEGRAM_CHAT_BURST,
+    max_retries=settings.TELEGRAM_MAX_RETRIES
+)
@@ -1,8 +1,11 @@
+from django.contrib.admin.views.decorators import staff_member_required
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
 
-from .views import TelegramBotWebhookView
+from .views import TelegramBotStatsView, TelegramBotWebhookView
 
 urlpatterns = [
     path('webhook/tgbot', csrf_exempt(TelegramBotWebhookView.as_view())),
+    path('tgbot/stats',
+         staff_member_required(TelegramBotStatsView.as_view())),
 ]
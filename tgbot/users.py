@@ -0,0 +1,118 @@
+"""users.py - Загрузка пользователя бота со связанными моделями
+
+Пользователь загружается одним запросом вместе с профилем и настройками
+поиска. Города не загружаются: обработчики берут их из city_registry
+по city_id. Во время обработки обновления (user_context) загруженный
+пользователь запоминается, и все обработчики этого обновления получают
+один и тот же объект без повторных запросов.
+Тем же запросом проверяется, есть ли у пользователя действующий
+(сохраненный не ранее TELEGRAM_STEP_TTL секунд назад) шаг диалога
+(has_step).
+"""
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import DateTimeField, Exists, ExpressionWrapper, OuterRef
+from django.db.models.functions import Now
+
+from .models import ConversationStep, User
+
+USER_RELATIONS = ('profile', 'profilesearch')
+# Очередь поиска и просмотренные анкеты изменяются только запросами в БД
+DEFERRED_FIELDS = ('profilesearch__unviewed', 'profilesearch__viewed')
+
+_local = threading.local()
+
+
+def get_step_expiry():
+    """Граница действия шагов диалога: более ранние шаги устарели
+
+    :return: Выражение now() - TELEGRAM_STEP_TTL, вычисляемое в БД
+    :rtype: ExpressionWrapper
+    """
+    return ExpressionWrapper(
+        Now() - timedelta(seconds=settings.TELEGRAM_STEP_TTL),
+        output_field=DateTimeField()
+    )
+
+
+def load_user(chat_id):
+    """Получение пользователя одним запросом (select_related)
+
+    :param int chat_id: Chat id пользователя
+    :return: Пользователь или None, если он не начинал регистрацию
+    :rtype: User
+    """
+    return User.objects.select_related(
+        *USER_RELATIONS
+    ).defer(
+        *DEFERRED_FIELDS
+    ).annotate(
+        has_step=Exists(
+            ConversationStep.objects.filter(
+                chat_id=OuterRef('chat_id'),
+                updated__gt=get_step_expiry()
+            )
+        )
+    ).filter(chat_id=chat_id).first()
+
+
+@contextmanager
+def user_context():
+    """Контекст обработки одного обновления"""
+    _local.users = {}
+    try:
+        yield
+    finally:
+        _local.users = None
+
+
+def get_user(chat_id):
+    """Получение пользователя (в контексте обновления - один раз)
+
+    :param int chat_id: Chat id пользователя
+    :rtype: User
+    :raise User.DoesNotExist: Пользователь не начинал регистрацию
+    """
+    users = getattr(_local, 'users', None)
+    if users is None:
+        user = load_user(chat_id)
+    elif chat_id in users:
+        user = users[chat_id]
+    else:
+        user = users[chat_id] = load_user(chat_id)
+    if user is None:
+        raise User.DoesNotExist(f'User {chat_id} does not exist')
+    return user
+
+
+def forget_user(chat_id):
+    """Сброс запомненного пользователя (после его создания)
+
+    :param int chat_id: Chat id пользователя
+    """
+    users = getattr(_local, 'users', None)
+    if users is not None:
+        users.pop(chat_id, None)
+
+
+def may_have_step(chat_id):
+    """Проверка наличия шага диалога без отдельного запроса к БД
+
+    В контексте обновления используется признак has_step загруженного
+    пользователя. Вне контекста и для незарегистрированного пользователя
+    (например, шаг /bug) наличие шага неизвестно.
+
+    :param int chat_id: Chat id пользователя
+    :return: False, если шага точно нет
+    :rtype: bool
+    """
+    if getattr(_local, 'users', None) is None:
+        return True
+    try:
+        user = get_user(chat_id)
+    except User.DoesNotExist:
+        return True
+    return getattr(user, 'has_step', True)
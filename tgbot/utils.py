@@ -0,0 +1,35 @@
+"""utils.py - Вспомогательные функции для обработки текста
+"""
+import re
+
+TRANSLITERATION = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n',
+    'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f',
+    'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+
+def normalize_city_name(name):
+    """Нормализация наименования города
+
+    Регистр не учитывается, ё заменяется на е, знаки препинания
+    и повторяющиеся пробелы заменяются одним пробелом.
+
+    :param str name: Наименование города
+    :return: Нормализованное наименование
+    :rtype: str
+    """
+    name = name.casefold().replace('ё', 'е')
+    return ' '.join(re.sub(r'[\W_]+', ' ', name).split())
+
+
+def transliterate(name):
+    """Транслитерация нормализованного наименования латиницей
+
+    :param str name: Нормализованное наименование города
+    :return: Наименование латиницей
+    :rtype: str
+    """
+    return ''.join(TRANSLITERATION.get(char, char) for char in name)
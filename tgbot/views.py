@@ -1,19 +1,69 @@
+import atexit
+import json
+
 from telebot import types
 
 from django.conf import settings
 from django.http import JsonResponse
 from django.views import View
 
-from .handlers import bot
+from .cities import city_cache
+from .dedupe import update_dedupe
+from .handlers import process_update
+from .outbox import WebhookReply
+from .throttling import rate_limiter
+from .workers import UpdateDispatcher
 
-bot.remove_webhook()
-bot.set_webhook(url=f"{settings.TELEGRAM_WEBHOOK_URL}/webhook/tgbot")
+dispatcher = UpdateDispatcher(
+    process=process_update,
+    workers=settings.TELEGRAM_WORKERS,
+    queue_size=settings.TELEGRAM_QUEUE_SIZE
+)
+# Потоки-демоны не держат процесс, поэтому при штатной остановке
+# веб-сервера очереди дорабатываются явно. Ответ на вебхук уже отправлен,
+# и обновления, не обработанные до срока, Telegram повторно не пришлет
+atexit.register(dispatcher.stop, settings.TELEGRAM_SHUTDOWN_TIMEOUT)
 
 
 class TelegramBotWebhookView(View):
 
     def post(self, request, *args, **kwargs):
-        json_str = request.body.decode('UTF-8')
-        update = types.Update.de_json(json_str)
-        bot.process_new_updates([update])
+        try:
+            data = json.loads(request.body.decode('UTF-8'))
+            update_id = int(data['update_id'])
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"error": "Invalid update"}, status=400)
+        # Повтор доставки отбрасывается до разбора обновления
+        if update_dedupe.is_duplicate(update_id):
+            return JsonResponse({"ok": "Duplicate update"})
+        try:
+            update = types.Update.de_json(data)
+        except (ValueError, KeyError, TypeError):
+            update_dedupe.forget(update_id)
+            return JsonResponse({"error": "Invalid update"}, status=400)
+        # Ответ на callback отправляется в теле ответа на вебхук, если
+        # обновление не ждет в очереди после других обновлений чата
+        timeout = settings.TELEGRAM_WEBHOOK_REPLY_TIMEOUT
+        reply = None
+        if (update.callback_query and timeout > 0
+                and not dispatcher.backlog(update)):
+            reply = WebhookReply()
+        if not dispatcher.submit(update, reply):
+            update_dedupe.forget(update_id)
+            return JsonResponse({"error": "Queue is full"}, status=503)
+        if reply is not None:
+            payload = reply.wait(timeout)
+            if payload is not None:
+                return JsonResponse(payload)
         return JsonResponse({"ok": "POST request processed"})
+
+
+class TelegramBotStatsView(View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({
+            'city_cache': city_cache.stats(),
+            'updates': dispatcher.stats(),
+            'dedupe': update_dedupe.stats(),
+            'rate_limiter': rate_limiter.stats(),
+        })
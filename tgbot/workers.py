@@ -0,0 +1,198 @@
+"""workers.py - Пул потоков для обработки обновлений от Telegram
+
+Обновления одного чата всегда попадают в одну и ту же очередь,
+поэтому обрабатываются строго по порядку. Обновления разных чатов
+обрабатываются параллельно.
+
+Обработка выполняется не более одного раза: вебхук подтверждает
+обновление Telegram до обработки, и повторно оно доставлено не будет.
+При остановке процесса потоки дорабатывают очереди не дольше
+TELEGRAM_SHUTDOWN_TIMEOUT. Обновления, оставшиеся в очереди после этого
+срока или при аварийном завершении процесса (SIGKILL, сбой), теряются.
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_FIELDS = (
+    'message', 'edited_message', 'channel_post', 'edited_channel_post',
+)
+USER_FIELDS = (
+    'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'my_chat_member', 'chat_member',
+)
+
+
+def get_update_chat_id(update):
+    """Определение чата, к которому относится обновление
+
+    :param Update update: Обновление от Telegram
+    :return: chat_id (для callback и т.п. - id пользователя)
+    :rtype: int
+    """
+    for field in MESSAGE_FIELDS:
+        message = getattr(update, field, None)
+        if message is not None:
+            return message.chat.id
+    for field in USER_FIELDS:
+        event = getattr(update, field, None)
+        if event is not None:
+            return event.from_user.id
+    return update.update_id
+
+
+def remaining(deadline):
+    """Время до истечения срока
+
+    :param deadline: Срок по time.monotonic() (None - без ограничения)
+    :return: Секунды до срока или None
+    """
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+
+class UpdateDispatcher:
+    """Ограниченный пул потоков с очередью на каждый поток
+
+    :param process: Функция обработки одного обновления
+        (принимает обновление и слот ответа на вебхук)
+    :param int workers: Количество потоков (0 - обработка в текущем потоке)
+    :param int queue_size: Размер очереди одного потока
+    """
+
+    def __init__(self, process, workers, queue_size):
+        self.process = process
+        self.workers = workers
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Запуск потоков (выполняется один раз)"""
+        with self._lock:
+            if self._threads:
+                return
+            for index, updates in enumerate(self.queues):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(updates,),
+                    name=f'tgbot-worker-{index}',
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Остановка потоков после обработки уже принятых обновлений
+
+        Обновления, не обработанные за timeout, теряются вместе
+        с процессом.
+
+        :param timeout: Общее время ожидания в секундах (None - не ограничено)
+        :return: Количество необработанных обновлений
+        :rtype: int
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for updates in self.queues[:len(threads)]:
+            try:
+                updates.put(None, timeout=remaining(deadline))
+            except queue.Full:
+                break
+        for thread in threads:
+            thread.join(remaining(deadline))
+        return sum(updates.unfinished_tasks for updates in self.queues)
+
+    def submit(self, update, reply=None, block=False):
+        """Постановка обновления в очередь
+
+        :param Update update: Обновление от Telegram
+        :param WebhookReply reply: Слот ответа на вебхук
+        :param bool block: Ждать места в переполненной очереди
+        :return: False, если очередь переполнена
+        :rtype: bool
+        """
+        if not self.workers:
+            self._handle(update, time.monotonic(), reply)
+            return True
+        self.start()
+        chat_id = get_update_chat_id(update)
+        updates = self.queues[chat_id % self.workers]
+        try:
+            updates.put((update, time.monotonic(), reply), block=block)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logger.warning(f'Update {update.update_id} rejected, queue full')
+            return False
+        return True
+
+    def backlog(self, update):
+        """Количество необработанных обновлений в очереди чата
+
+        :param Update update: Обновление от Telegram
+        :return: Обновления в очереди и в обработке (0 - очередь свободна)
+        :rtype: int
+        """
+        if not self.workers:
+            return 0
+        chat_id = get_update_chat_id(update)
+        return self.queues[chat_id % self.workers].unfinished_tasks
+
+    def stats(self):
+        """Показатели работы пула
+
+        :return: Глубина очередей, задержка обработки (сек.) и счетчики
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': sum(updates.qsize() for updates in self.queues),
+                'processed': self.processed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'last_lag': round(self.last_lag, 3),
+                'max_lag': round(self.max_lag, 3),
+            }
+
+    def _work(self, updates):
+        while True:
+            item = updates.get()
+            if item is None:
+                updates.task_done()
+                return
+            try:
+                self._handle(*item)
+            finally:
+                updates.task_done()
+
+    def _handle(self, update, enqueued, reply):
+        lag = time.monotonic() - enqueued
+        close_old_connections()
+        try:
+            self.process(update, reply)
+        except Exception:
+            logger.exception(f'Update {update.update_id} processing failed')
+            failed = True
+        else:
+            failed = False
+        finally:
+            close_old_connections()
+        with self._lock:
+            self.processed += 1
+            self.failed += failed
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)